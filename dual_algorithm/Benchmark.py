@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from random import Random
+from sys import argv
+
+import numpy as np
+
+from CSRGraph import CSRGraph
+from ShortestPath import ShortestPathBuffer, shortest_path_csr
+from EppsteinKSP import EppsteinPathGraph
+from YenKSP import YenKSPCSR
+from ContractionHierarchy import ContractionHierarchy
+from Metrics import Metrics
+from dual_algorithm import SolverOptions, dual_algorithm, step0, step3_secant
+
+
+__doc__ = f"""
+Usage:
+    {__file__} [--sizes n ...] [--tightness r ...] [--repeat num] [--paths num]
+        [--output result_file] [--graph_dir dir] [--no_memory]
+
+Options:
+    --sizes      : Side lengths of the grid graphs (n x n nodes, default: 20 40 80)
+    --tightness  : Upper bounds between the minimum t (0) and the t of the
+                   shortest path on c (1) (default: 0.1 0.5 0.9)
+    --repeat     : Number of timed runs of each stage (the minimum is recorded, default: 3)
+    --paths      : Number of k shortest paths of the Step4 stages (default: 100)
+    --output     : JSON lines result file (default: benchmark.jsonl)
+    --graph_dir  : Directory of the generated graph files (a temporary directory if omitted)
+    --no_memory  : Do not record the peak memory (tracemalloc run of each stage)
+
+Result (one line per graph, upper bound and stage):
+    graph, nodes, edges, tightness, upper_bound, stage, time [s], peak_memory [byte],
+    and the iterations, paths or f and the counters (Metrics) of the stage
+    the stages are load, load_cached, contraction, contraction_cached, step0, step1, step2, step3,
+    step3_ch, step4_eppstein, step4_yen, dual_algorithm, dual_algorithm_yen
+"""
+
+
+def usage():
+    print(__doc__)
+
+
+def argv_values(argv, flag, default, cast):
+    """ values after flag up to the next option """
+    if flag not in argv:
+        return default
+    values = []
+    for value in argv[argv.index(flag)+1:]:
+        if value.startswith('--'):
+            break
+        values.append(cast(value))
+    return values
+
+
+def write_grid_graph(path, n, seed=0):
+    """ n x n grid graph (edges right and down) with random c and t in 1, ..., 20 """
+    rnd = Random(seed)
+    with open(path, 'w') as f:
+        for i in range(n):
+            for j in range(n):
+                for k, l in ((i+1, j), (i, j+1)):
+                    if k < n and l < n:
+                        print(i*n+j, k*n+l, rnd.randint(1, 20), rnd.randint(1, 20), sep=',', file=f)
+
+
+def measure(function, repeat, memory):
+    """ result of function, minimum wall time of repeat runs and the peak memory of one more run """
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start_time)
+    peak_memory = None
+    if memory:
+        tracemalloc.start()
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, min(times), peak_memory
+
+
+def lagrangian_multiplier(graph, upper_bound, plus, minus, shortest_path):
+    """ Step3 of dual_algorithm (step3_secant), return u and the number of iterations
+    plus, minus: Step1 and Step2 paths (edge ids) of graph
+    shortest_path: function of (w, u) to the edge ids of the shortest path on w """
+    path_plus, cost_plus = graph.c[plus].sum(), graph.t[plus].sum() - upper_bound
+    if cost_plus <= 0:
+        return 0, 0
+    path_minus, cost_minus = graph.c[minus].sum(), graph.t[minus].sum() - upper_bound
+    metrics = Metrics()
+    _, u, _, _, _ = step3_secant(graph, upper_bound, shortest_path, (path_plus, cost_plus),
+                                 (minus, path_minus, cost_minus), path_plus, path_minus,
+                                 SolverOptions(verbose=False), metrics=metrics)
+    return u, metrics.counts['step3_iterations']
+
+
+def k_shortest_paths(paths, k):
+    """ number of paths generated by paths up to k """
+    num_paths = 0
+    for _ in paths:
+        num_paths += 1
+        if num_paths == k:
+            break
+    paths.close()
+    return num_paths
+
+
+def solve(graph, source, target, upper_bound, options):
+    """ f and the counters of dual_algorithm """
+    metrics = Metrics()
+    _, path_length, _ = dual_algorithm(graph, source, target, upper_bound, options, metrics=metrics)
+    return dict(metrics.counts, f=None if path_length is None else float(path_length))
+
+
+def run_info():
+    """ commit, python and numpy versions of the run """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def benchmark(graph_file, n, tightness_list, repeat=3, num_paths=100, memory=True):
+    """ generator of the result rows of the n x n grid graph of graph_file
+    (the source is the corner node 0 and the target is the opposite corner n*n-1) """
+    graph, load_time, load_memory = measure(lambda: CSRGraph.read(graph_file, cache=False), repeat, memory)
+    graph_info = {'graph': os.path.basename(graph_file),
+                  'nodes': graph.number_of_nodes(), 'edges': graph.number_of_edges()}
+    yield dict(graph_info, stage='load', time=load_time, peak_memory=load_memory)
+    CSRGraph.read(graph_file, cache=True) # write the binary graph file
+    _, load_time, load_memory = measure(lambda: CSRGraph.read(graph_file, cache=True), repeat, memory)
+    yield dict(graph_info, stage='load_cached', time=load_time, peak_memory=load_memory)
+
+    try:
+        hierarchy, step_time, step_memory = measure(lambda: ContractionHierarchy(graph), repeat, memory)
+        yield dict(graph_info, stage='contraction', time=step_time, peak_memory=step_memory,
+                   shortcuts=hierarchy.number_of_shortcuts(), triangles=hierarchy.num_triangles)
+        ContractionHierarchy.read(graph, graph_file) # write the hierarchy file
+        _, step_time, step_memory = measure(lambda: ContractionHierarchy.read(graph, graph_file), repeat, memory)
+        yield dict(graph_info, stage='contraction_cached', time=step_time, peak_memory=step_memory)
+    except ValueError as e:
+        # the step3_ch stages are skipped
+        print(f'{graph_info["graph"]}: {e}')
+        hierarchy = None
+
+    # the node ids are in the order of the sorted labels, not of the grid
+    source, target = '0', str(n*n-1)
+    source_id, target_id = graph.node_index[source], graph.node_index[target]
+    buffer = ShortestPathBuffer(graph)
+    t_min = graph.t[shortest_path_csr(graph, source_id, target_id, graph.t, buffer)].sum()
+    t_max = graph.t[shortest_path_csr(graph, source_id, target_id, graph.c, buffer)].sum()
+
+    for tightness in tightness_list:
+        upper_bound = float(t_min + tightness * (t_max - t_min))
+        info = dict(graph_info, tightness=tightness, upper_bound=upper_bound)
+
+        (subgraph, _, _), step_time, step_memory = measure(
+            lambda: step0(graph, source_id, target_id, upper_bound), repeat, memory)
+        yield dict(info, stage='step0', time=step_time, peak_memory=step_memory,
+                   sub_nodes=subgraph.number_of_nodes(), sub_edges=subgraph.number_of_edges())
+
+        sub_source, sub_target = subgraph.node_index[source], subgraph.node_index[target]
+        sub_buffer = ShortestPathBuffer(subgraph)
+        paths = {}
+        for stage, key in (('step1', 'c'), ('step2', 't')):
+            paths[key], step_time, step_memory = measure(
+                lambda: shortest_path_csr(subgraph, sub_source, sub_target, getattr(subgraph, key), sub_buffer),
+                repeat, memory)
+            yield dict(info, stage=stage, time=step_time, peak_memory=step_memory)
+
+        def shortest_path(w, u):
+            return shortest_path_csr(subgraph, sub_source, sub_target, w, sub_buffer)
+        (u, iterations), step_time, step_memory = measure(
+            lambda: lagrangian_multiplier(subgraph, upper_bound, paths['c'], paths['t'], shortest_path),
+            repeat, memory)
+        yield dict(info, stage='step3', time=step_time, peak_memory=step_memory, iterations=iterations, u=float(u))
+
+        def step3_ch():
+            # the hierarchy of the graph restricted to subgraph and customized for each u
+            sub_hierarchy = hierarchy.restrict(subgraph.parent_edges)
+            def shortest_path(w, u):
+                sub_hierarchy.customize(w)
+                return sub_hierarchy.path(source_id, target_id)
+            return lagrangian_multiplier(subgraph, upper_bound, paths['c'], paths['t'], shortest_path)
+        if hierarchy is not None:
+            (_, iterations), step_time, step_memory = measure(step3_ch, repeat, memory)
+            yield dict(info, stage='step3_ch', time=step_time, peak_memory=step_memory, iterations=iterations)
+
+        w = subgraph.weight(u)
+        for stage, paths in (('step4_eppstein', lambda: EppsteinPathGraph(subgraph, sub_target, w).paths(sub_source)),
+                             ('step4_yen', lambda: YenKSPCSR(subgraph, sub_source, sub_target, w, sub_buffer))):
+            found, step_time, step_memory = measure(lambda: k_shortest_paths(paths(), num_paths), repeat, memory)
+            yield dict(info, stage=stage, time=step_time, peak_memory=step_memory, paths=found)
+
+        for stage, options in (('dual_algorithm', SolverOptions(verbose=False)),
+                               ('dual_algorithm_yen', SolverOptions(yen=True, verbose=False))):
+            result, step_time, step_memory = measure(
+                lambda: solve(graph, source, target, upper_bound, options), repeat, memory)
+            yield dict(info, stage=stage, time=step_time, peak_memory=step_memory, **result)
+
+
+def main(sizes, tightness_list, repeat=3, num_paths=100, output='benchmark.jsonl', graph_dir=None, memory=True):
+    info = run_info()
+    tmp_dir = None
+    if graph_dir is None:
+        graph_dir = tmp_dir = tempfile.mkdtemp()
+    try:
+        with open(output, 'w') as f:
+            for n in sizes:
+                graph_file = os.path.join(graph_dir, f'grid{n}.csv')
+                if not os.path.exists(graph_file):
+                    write_grid_graph(graph_file, n, seed=n)
+                for row in benchmark(graph_file, n, tightness_list, repeat, num_paths, memory):
+                    row = dict(info, **row)
+                    print(json.dumps(row), file=f, flush=True)
+                    print(f'{row["graph"]:>12s} {row.get("tightness", "-")!s:>5s} {row["stage"]:>18s} {row["time"]:10.4f}s')
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    if '--help' in argv or '-h' in argv:
+        usage()
+    else:
+        main(sizes=argv_values(argv, '--sizes', [20, 40, 80], int),
+             tightness_list=argv_values(argv, '--tightness', [0.1, 0.5, 0.9], float),
+             repeat=int(argv[argv.index('--repeat')+1]) if '--repeat' in argv else 3,
+             num_paths=int(argv[argv.index('--paths')+1]) if '--paths' in argv else 100,
+             output=argv[argv.index('--output')+1] if '--output' in argv else 'benchmark.jsonl',
+             graph_dir=argv[argv.index('--graph_dir')+1] if '--graph_dir' in argv else None,
+             memory='--no_memory' not in argv)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import json
+import numpy as np
+
+
+# binary graph file: MAGIC, header length (8 bytes), json header, aligned arrays
+MAGIC = b'CSRGRAPH'
+VERSION = 1
+ALIGNMENT = 64
+ARRAYS = ('tails', 'heads', 'keys', 'c', 't', 'indptr', 'rev_edges', 'rev_indptr', 'x', 'y')
+
+
+class CSRGraph:
+    """ compressed sparse row graph (multipul directed graph)
+
+    nodes are renumbered to 0, ..., n-1 and edges to 0, ..., m-1
+    edges are sorted by tail node, so that the out edges of node v are
+    edge ids indptr[v], ..., indptr[v+1]-1
+    (rev_indptr and rev_edges give the in edges in the same way)
+    x, y are the node positions (nan if the position is unknown)
+    """
+
+    def __init__(self, nodes, tails, heads, keys, c, t, x=None, y=None):
+        # node id -> node label, node label -> node id
+        self._nodes = list(nodes)
+        self._node_index = None
+        self._labels = None
+        nan = np.full(len(self.nodes), np.nan)
+        self.x = nan if x is None else np.asarray(x, dtype=np.float64)
+        self.y = nan.copy() if y is None else np.asarray(y, dtype=np.float64)
+
+        tails = np.asarray(tails, dtype=np.int64)
+        heads = np.asarray(heads, dtype=np.int64)
+        order = np.lexsort((keys, heads, tails))
+        self.tails = tails[order]
+        self.heads = heads[order]
+        self.keys  = np.asarray(keys, dtype=np.int64)[order]
+        self.c     = np.asarray(c, dtype=np.float64)[order]
+        self.t     = np.asarray(t, dtype=np.float64)[order]
+
+        num_nodes = len(self.nodes)
+        self.indptr = np.zeros(num_nodes+1, dtype=np.int64)
+        np.cumsum(np.bincount(self.tails, minlength=num_nodes), out=self.indptr[1:])
+        # in edges of node v are edge ids rev_edges[rev_indptr[v]:rev_indptr[v+1]]
+        self.rev_edges = np.argsort(self.heads, kind='stable')
+        self.rev_indptr = np.zeros(num_nodes+1, dtype=np.int64)
+        np.cumsum(np.bincount(self.heads, minlength=num_nodes), out=self.rev_indptr[1:])
+
+    @classmethod
+    def from_networkx(cls, MultiGraph, weight='c', cost='t'):
+        """MultiGraph: networkx multipul directed graph"""
+        nodes = list(MultiGraph)
+        node_index = {node: v for v, node in enumerate(nodes)}
+        tails, heads, keys, c, t = [], [], [], [], []
+        for tail, head, key, weights in MultiGraph.edges(keys=True, data=True):
+            tails.append(node_index[tail])
+            heads.append(node_index[head])
+            keys.append(key)
+            c.append(weights[weight])
+            t.append(weights[cost])
+        x = [MultiGraph.nodes[node].get('x', np.nan) for node in nodes]
+        y = [MultiGraph.nodes[node].get('y', np.nan) for node in nodes]
+        return cls(nodes, tails, heads, keys, c, t, x, y)
+
+    @classmethod
+    def read_csv(cls, edge_file, chunk_size=1<<22):
+        """ read the graph file chunk by chunk (chunk_size: bytes per chunk)
+        [node format]: node x_position y_position (or node,x_position,y_position)
+        [edge format]: tail node,head node,objective cost,constraint cost
+        rows of other formats (e.g. section names) are skipped """
+        node_index = dict()
+        pos = dict()
+        chunks = []
+
+        def intern(labels):
+            # node label -> node id, the dict is looked up once per distinct label in the chunk
+            unique_labels, inverse = np.unique(np.array(labels), return_inverse=True)
+            ids = [node_index.setdefault(label, len(node_index)) for label in unique_labels.tolist()]
+            return np.array(ids, dtype=np.int64)[inverse]
+
+        with open(edge_file, 'r') as f:
+            while True:
+                lines = f.readlines(chunk_size)
+                if not lines:
+                    break
+                edge_rows = []
+                for line in lines:
+                    row = line.rstrip('\r\n')
+                    num_fields = row.count(',') + 1
+                    if num_fields == 4:
+                        edge_rows.append(row)
+                    elif num_fields == 3:
+                        node, x, y = row.split(',')
+                        pos[node] = (float(x), float(y))
+                    elif num_fields == 1 and len(row.split()) == 3:
+                        node, x, y = row.split()
+                        pos[node] = (float(x), float(y))
+                if not edge_rows:
+                    continue
+                fields = ','.join(edge_rows).split(',')
+                ids = intern(fields[0::4] + fields[1::4])
+                chunks.append((ids[:len(edge_rows)], ids[len(edge_rows):],
+                               np.array(fields[2::4], dtype=np.float64),
+                               np.array(fields[3::4], dtype=np.float64)))
+
+        nodes = list(node_index)
+        if chunks:
+            tails, heads, c, t = (np.concatenate(arrays) for arrays in zip(*chunks))
+        else:
+            tails, heads = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            c, t = np.zeros(0), np.zeros(0)
+        # key of parallel edges: order of appearance in the file
+        order = np.lexsort((np.arange(len(tails)), heads, tails))
+        is_first = np.ones(len(order), dtype=bool)
+        is_first[1:] = (tails[order][1:] != tails[order][:-1]) | (heads[order][1:] != heads[order][:-1])
+        first = np.maximum.accumulate(np.where(is_first, np.arange(len(order)), 0))
+        keys = np.empty(len(order), dtype=np.int64)
+        keys[order] = np.arange(len(order)) - first
+        x = [pos.get(node, (np.nan, np.nan))[0] for node in nodes]
+        y = [pos.get(node, (np.nan, np.nan))[1] for node in nodes]
+        return cls(nodes, tails, heads, keys, c, t, x, y)
+
+    @classmethod
+    def read(cls, edge_file, cache=True):
+        """ read the graph file through the binary graph file edge_file.csrg
+        the binary file is (re)written when it is older than the graph file """
+        cache_file = edge_file + '.csrg'
+        stat = os.stat(edge_file)
+        source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if cache and os.path.exists(cache_file):
+            try:
+                graph, header = cls.load(cache_file, with_header=True)
+                if header.get('source') == source:
+                    return graph
+            except ValueError:
+                pass
+        graph = cls.read_csv(edge_file)
+        if cache:
+            try:
+                graph.save(cache_file, source=source)
+            except OSError as e:
+                print(f'cannot write the binary graph file {cache_file}: {e}')
+        return graph
+
+    def save(self, path, source=None):
+        """ write the binary graph file (node labels are written as str) """
+        encoded = [str(node).encode() for node in self.nodes]
+        label_offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+        np.cumsum([len(label) for label in encoded], out=label_offsets[1:])
+        arrays = {name: getattr(self, name) for name in ARRAYS}
+        arrays['label_offsets'] = label_offsets
+        arrays['label_bytes'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+        header = {'version': VERSION, 'source': source, 'arrays': {}}
+        offset = 0
+        for name, array in arrays.items():
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        header_bytes = json.dumps(header).encode()
+        start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.seek(start + header['arrays'][name]['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(start + offset)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, with_header=False):
+        """ open the binary graph file, the arrays are memory-mapped (read only) """
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a binary graph file')
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length))
+        if header.get('version') != VERSION:
+            raise ValueError(f'{path} has an unknown version {header.get("version")}')
+        start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+
+        arrays = dict()
+        for name, info in header['arrays'].items():
+            shape = tuple(info['shape'])
+            if np.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype=info['dtype'])
+            else:
+                arrays[name] = np.memmap(path, dtype=info['dtype'], mode='r',
+                                         offset=start+info['offset'], shape=shape)
+
+        graph = cls.__new__(cls)
+        for name in ARRAYS:
+            setattr(graph, name, arrays[name])
+        graph._nodes = None
+        graph._node_index = None
+        graph._labels = arrays['label_offsets'], arrays['label_bytes']
+        if with_header:
+            return graph, header
+        return graph
+
+    @property
+    def nodes(self):
+        """ node id -> node label (decoded on demand for a binary graph file) """
+        if self._nodes is None:
+            offsets, label_bytes = self._labels
+            label_bytes = label_bytes.tobytes()
+            offsets = offsets.tolist()
+            self._nodes = [label_bytes[a:b].decode() for a, b in zip(offsets, offsets[1:])]
+        return self._nodes
+
+    @property
+    def node_index(self):
+        """ node label -> node id """
+        if self._node_index is None:
+            self._node_index = {node: v for v, node in enumerate(self.nodes)}
+        return self._node_index
+
+    def number_of_nodes(self):
+        return len(self.indptr) - 1
+
+    def number_of_edges(self):
+        return len(self.tails)
+
+    def has_positions(self):
+        return self.number_of_nodes() > 0 and not (np.isnan(self.x).any() or np.isnan(self.y).any())
+
+    def reverse(self):
+        """ graph with the reversed edges (edge ids are renumbered) """
+        return CSRGraph(self.nodes, self.heads, self.tails, self.keys, self.c, self.t, self.x, self.y)
+
+    def reachable(self, source, reverse=False):
+        """ boolean array of the nodes reachable from source
+        (the nodes which reach source if reverse) """
+        if reverse:
+            indptr, neighbors = self.rev_indptr, self.tails[self.rev_edges]
+        else:
+            indptr, neighbors = self.indptr, self.heads
+        is_reachable = np.zeros(self.number_of_nodes(), dtype=bool)
+        is_reachable[source] = True
+        frontier = np.array([source], dtype=np.int64)
+        while frontier.size:
+            # the out edges of all the frontier nodes at once (breadth first by levels)
+            starts = indptr[frontier]
+            counts = indptr[frontier+1] - starts
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            next_nodes = neighbors[offsets + np.arange(offsets.size)]
+            frontier = np.unique(next_nodes[~is_reachable[next_nodes]])
+            is_reachable[frontier] = True
+        return is_reachable
+
+    def subgraph(self, node_mask, edge_mask=None):
+        """ graph induced by the nodes of node_mask (nodes are renumbered)
+        edge_mask: edges which are kept (all the edges between the nodes if None)
+        the edge id of graph of every edge is kept in parent_edges (sorted)
+        and the node id of graph of every node in parent_nodes (sorted) """
+        node_ids = np.cumsum(node_mask) - 1
+        if edge_mask is None:
+            edge_mask = node_mask[self.tails] & node_mask[self.heads]
+        else:
+            edge_mask = edge_mask & node_mask[self.tails] & node_mask[self.heads]
+        nodes = [node for node, is_node in zip(self.nodes, node_mask.tolist()) if is_node]
+        graph = CSRGraph(nodes, node_ids[self.tails[edge_mask]], node_ids[self.heads[edge_mask]],
+                         self.keys[edge_mask], self.c[edge_mask], self.t[edge_mask],
+                         self.x[node_mask], self.y[node_mask])
+        # the edges are sorted in the same order, so that they keep the order of graph
+        graph.parent_edges = np.flatnonzero(edge_mask)
+        graph.parent_nodes = np.flatnonzero(node_mask)
+        return graph
+
+    def weight(self, u):
+        """ lagrangian weight c + u*t of every edge """
+        return self.c + u * self.t
+
+    def edge(self, e):
+        """ edge id -> (tail, head, key) with node labels """
+        return self.nodes[self.tails[e]], self.nodes[self.heads[e]], int(self.keys[e])
+
+    def path_edges(self, path):
+        """ list of edge ids -> list of (tail, head, key) """
+        return [self.edge(e) for e in path]
+
+    def path_nodes(self, path):
+        """ list of edge ids -> list of node labels """
+        if not path:
+            return []
+        return [self.nodes[self.tails[path[0]]]] + [self.nodes[self.heads[e]] for e in path]
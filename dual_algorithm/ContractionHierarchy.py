@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import copy
+import os
+import zipfile
+import networkx as nx
+import numpy as np
+
+
+# hierarchy file (np.savez): VERSION, the stamp of the graph file and the arrays of the hierarchy
+VERSION = 1
+ARRAYS = ('order', 'rank', 'indptr', 'arc_head', 'arc_tail', 'down_arcs', 'down_indptr',
+          'edge_slot', 'slot_edges', 'edge_slots', 'edge_starts', 'slot_indptr')
+TRIANGLES = ('triangle_left', 'triangle_right', 'triangle_targets', 'triangle_level')
+
+
+def undirected_neighbors(graph):
+    """ sets of the neighbors of every node on the undirected graph (without self loops) """
+    neighbors = [set() for _ in range(graph.number_of_nodes())]
+    for tail, head in zip(graph.tails.tolist(), graph.heads.tolist()):
+        if tail != head:
+            neighbors[tail].add(head)
+            neighbors[head].add(tail)
+    return neighbors
+
+
+def breadth_first_levels(neighbors, stamp, root, root_stamp):
+    """ levels of the breadth first search from root on the nodes of root_stamp
+    (the stamp of a visited node is set to -1) """
+    stamp[root] = -1
+    levels = [[root]]
+    while True:
+        level = []
+        for v in levels[-1]:
+            for w in neighbors[v]:
+                if stamp[w] == root_stamp:
+                    stamp[w] = -1
+                    level.append(w)
+        if not level:
+            return levels
+        levels.append(level)
+
+
+def split_levels(left, right, targets, level):
+    """ per level: the slots of the triangles, the slots updated and the starts of their triangles
+    (the triangles are sorted by level and target) """
+    levels = []
+    bounds = np.flatnonzero(np.diff(level)) + 1
+    for begin, end in zip(np.r_[0, bounds], np.r_[bounds, len(targets)]) if len(targets) else ():
+        slots, starts = np.unique(targets[begin:end], return_index=True)
+        levels.append((left[begin:end], right[begin:end], slots, starts))
+    return levels
+
+
+def nested_dissection_order(neighbors, leaf_size=16):
+    """ contraction order of the nodes (the first node is contracted first)
+    a part is split by a level of the breadth first search from a far node (the smallest
+    level which leaves 1/3 - 2/3 of the nodes on each side) and the separator is
+    contracted after the two sides """
+    stamp = [-1] * len(neighbors)
+    num_stamps = 0
+    reverse_order = []
+    parts = [list(range(len(neighbors)))]
+    while parts:
+        part = parts.pop()
+        part_stamp = num_stamps = num_stamps + 1
+        for v in part:
+            stamp[v] = part_stamp
+        # connected components of the part
+        for root in part:
+            if stamp[root] != part_stamp:
+                continue
+            levels = breadth_first_levels(neighbors, stamp, root, part_stamp)
+            nodes = [v for level in levels for v in level]
+            if len(nodes) <= leaf_size:
+                reverse_order.extend(nodes)
+                continue
+            # two sweeps from the last node found (a far node of the component)
+            for _ in range(2):
+                component_stamp = num_stamps = num_stamps + 1
+                for v in nodes:
+                    stamp[v] = component_stamp
+                levels = breadth_first_levels(neighbors, stamp, levels[-1][0], component_stamp)
+            if len(levels) < 3:
+                reverse_order.extend(nodes)
+                continue
+            # the nodes of the level which have a neighbor in the next level separate the levels
+            separator, count = None, 0
+            for middle in range(1, len(levels)-1):
+                count += len(levels[middle-1])
+                if len(nodes) <= 3 * count <= 2 * len(nodes)\
+                or (separator is None and (2 * (count + len(levels[middle])) > len(nodes) or middle == len(levels)-2)):
+                    next_level = set(levels[middle+1])
+                    level = [v for v in levels[middle] if not next_level.isdisjoint(neighbors[v])]
+                    if separator is None or len(level) < len(separator):
+                        separator = level
+            reverse_order.extend(separator)
+            separator = set(separator)
+            parts.append([v for v in nodes if v not in separator])
+    return reverse_order[::-1]
+
+
+def write_hierarchy_file(path, arrays):
+    """ np.savez of arrays through a temporary file (replaced at once) """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f'cannot write the hierarchy file {path}: {e}')
+
+
+class ContractionHierarchy:
+    """ customizable contraction hierarchy of the CSRGraph
+
+    the contraction order and the shortcuts (the chordal supergraph of the undirected graph)
+    do not depend on the weight, so that they are built once per graph, and customize(weight)
+    computes the weights of the shortcuts of a new weight (c + u*t in Step3) by their
+    lower triangles, level by level of the elimination tree
+
+    a query is two upward searches along the ancestors of source and target in the elimination
+    tree (no priority queue), the path is unpacked to the edges of the graph by the triangles
+    the weights must be non-negative (no negative cycle)
+    restrict(edges) keeps the triangles of a subgraph (Step0) for the customizations of a query
+
+    arc a joins arc_tail[a] and arc_head[a] (contracted later), slot 2a is the weight
+    of the edge arc_tail[a] -> arc_head[a] (upward) and slot 2a+1 of the reverse edge (downward)
+
+    order: contraction order of the nodes (nested dissection order if None)
+    max_triangles: ValueError is raised if the shortcuts have more lower triangles
+                   (a graph without small separators, the customization would be slower than Dijkstra)
+    read(graph, edge_file) keeps the order and the shortcuts in edge_file.cch for the later runs
+    """
+
+    def __init__(self, graph, order=None, max_triangles=5000000):
+        n = graph.number_of_nodes()
+        neighbors = undirected_neighbors(graph)
+        if order is None:
+            order = nested_dissection_order(neighbors)
+        rank = [0] * n
+        for r, v in enumerate(order):
+            rank[v] = r
+        self.order = np.asarray(order, dtype=np.int64)
+        self.rank = np.asarray(rank, dtype=np.int64)
+
+        # shortcuts: the upper neighbors of a contracted node are joined (added to its parent)
+        up = [{w for w in neighbors[v] if rank[w] > rank[v]} for v in range(n)]
+        for v in order:
+            if up[v]:
+                parent = min(up[v], key=rank.__getitem__)
+                up[parent] |= up[v]
+                up[parent].discard(parent)
+        up = [sorted(up[v], key=rank.__getitem__) for v in range(n)]
+        self.num_triangles = sum(len(heads) * (len(heads)-1) // 2 for heads in up)
+        if max_triangles is not None and self.num_triangles > max_triangles:
+            raise ValueError(f'the contraction hierarchy has {self.num_triangles} triangles'
+                             f' (more than {max_triangles})')
+        self.indptr = np.zeros(n+1, dtype=np.int64)
+        np.cumsum([len(heads) for heads in up], out=self.indptr[1:])
+        self.arc_head = np.array([w for heads in up for w in heads], dtype=np.int64)
+        self.arc_tail = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.indptr))
+        # arcs are sorted by the key tail * n + rank of head
+        arc_keys = self.arc_tail * n + self.rank[self.arc_head]
+
+        # lower triangles: arcs x - y and x - z of the shortcut y - z (rank x < rank y < rank z)
+        xy, xz, yz = [], [], []
+        pairs = dict()
+        for x in range(n):
+            start, k = int(self.indptr[x]), int(self.indptr[x+1] - self.indptr[x])
+            if k < 2:
+                continue
+            if k not in pairs:
+                pairs[k] = np.triu_indices(k, 1)
+            i, j = pairs[k]
+            xy.append((start + i).astype(np.int32))
+            xz.append((start + j).astype(np.int32))
+            yz.append(np.searchsorted(arc_keys, self.arc_head[start+i] * n + self.rank[self.arc_head[start+j]])
+                      .astype(np.int32))
+        concat = lambda arrays: np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int32)
+        xy, xz, yz = concat(xy), concat(xz), concat(yz)
+
+        # level of a node: 1 + the maximum level of the nodes below it, so that all the
+        # lower triangles of the arcs of a node are in the earlier levels
+        level = [0] * n
+        arc_head = self.arc_head.tolist()
+        indptr = self.indptr.tolist()
+        for x in order:
+            for a in range(indptr[x], indptr[x+1]):
+                level[arc_head[a]] = max(level[arc_head[a]], level[x] + 1)
+        # slot y -> z by y -> x -> z and slot z -> y by z -> x -> y
+        targets = np.concatenate((2*yz, 2*yz+1))
+        left = np.concatenate((2*xy+1, 2*xz+1))
+        right = np.concatenate((2*xz, 2*xy))
+        triangle_level = np.tile(np.asarray(level, dtype=np.int32)[self.arc_tail[xy]], 2)
+        sort = np.lexsort((targets, triangle_level))
+        self.triangles = left[sort], right[sort], targets[sort], triangle_level[sort]
+        self.levels = split_levels(*self.triangles)
+        # lower arcs of every node (the triangles of the path unpacking)
+        self.down_arcs = np.argsort(self.arc_head, kind='stable')
+        self.down_indptr = np.zeros(n+1, dtype=np.int64)
+        np.cumsum(np.bincount(self.arc_head, minlength=n), out=self.down_indptr[1:])
+
+        # slot of every edge of the graph (-1 for self loops)
+        tails, heads = graph.tails, graph.heads
+        low = np.where(self.rank[tails] < self.rank[heads], tails, heads)
+        high = np.where(self.rank[tails] < self.rank[heads], heads, tails)
+        edge_slot = 2 * np.searchsorted(arc_keys, low * n + self.rank[high]) + (low != tails)
+        edge_slot[tails == heads] = -1
+        self.edge_slot = edge_slot
+        self.slot_edges = np.argsort(edge_slot, kind='stable')
+        self.slot_edges = self.slot_edges[edge_slot[self.slot_edges] >= 0]
+        sorted_slots = edge_slot[self.slot_edges]
+        self.edge_slots, self.edge_starts = np.unique(sorted_slots, return_index=True)
+        self.slot_indptr = np.searchsorted(sorted_slots, np.arange(2*len(self.arc_head)+1))
+
+        self.num_edges = graph.number_of_edges()
+        self.edges = None
+        self.allocate()
+
+    @classmethod
+    def read(cls, graph, edge_file, cache=True, max_triangles=5000000):
+        """ hierarchy of the graph of edge_file through the hierarchy file edge_file.cch
+        the file is (re)written when it is older than the graph file, as the binary graph file
+        (a graph with too many triangles is also recorded, its ValueError is raised again) """
+        cache_file = edge_file + '.cch'
+        stat = os.stat(edge_file)
+        header = dict(version=VERSION, source=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64),
+                      max_triangles=max_triangles)
+        if cache and os.path.exists(cache_file):
+            error = None
+            try:
+                with np.load(cache_file) as data:
+                    if all(np.array_equal(data[key], value) for key, value in header.items()):
+                        if data['error'].size:
+                            error = str(data['error'][0])
+                        else:
+                            hierarchy = cls.load(graph, data)
+                            if hierarchy is not None:
+                                return hierarchy
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                pass
+            if error is not None:
+                raise ValueError(error)
+        try:
+            hierarchy = cls(graph, max_triangles=max_triangles)
+        except ValueError as e:
+            if cache:
+                write_hierarchy_file(cache_file, dict(header, error=np.array([str(e)])))
+            raise
+        if cache:
+            hierarchy.save(cache_file, header)
+        return hierarchy
+
+    def save(self, path, header):
+        """ write the hierarchy file with header (version, source and max_triangles of read) """
+        arrays = dict(header, error=np.array([], dtype=str),
+                      num_triangles=self.num_triangles, num_edges=self.num_edges)
+        arrays.update({name: getattr(self, name) for name in ARRAYS})
+        arrays.update(zip(TRIANGLES, self.triangles))
+        write_hierarchy_file(path, arrays)
+
+    @classmethod
+    def load(cls, graph, data):
+        """ hierarchy of the arrays of a hierarchy file (None if they are not the ones of graph) """
+        if len(data['rank']) != graph.number_of_nodes() or int(data['num_edges']) != graph.number_of_edges():
+            return None
+        hierarchy = cls.__new__(cls)
+        for name in ARRAYS:
+            setattr(hierarchy, name, data[name])
+        hierarchy.triangles = tuple(data[name] for name in TRIANGLES)
+        hierarchy.levels = split_levels(*hierarchy.triangles)
+        hierarchy.num_triangles = int(data['num_triangles'])
+        hierarchy.num_edges = int(data['num_edges'])
+        hierarchy.edges = None
+        hierarchy.allocate()
+        return hierarchy
+
+    def allocate(self):
+        """ weights of the arcs and labels of the queries """
+        n = len(self.rank)
+        self.w = np.full(2*len(self.arc_head), np.inf)
+        self.edge_weight = None
+        self.distance = [np.full(n, np.inf), np.full(n, np.inf)]
+        self.predecessor = [np.full(n, -1, dtype=np.int64), np.full(n, -1, dtype=np.int64)]
+        self.num_settled = 0 # ancestors searched by the last query
+
+    def number_of_shortcuts(self):
+        return len(self.arc_head)
+
+    def restrict(self, edges):
+        """ hierarchy of the subgraph of edges (sorted edge ids) which shares the arrays of this one
+        the triangles with a node which is not an end of edges are dropped (their arcs are infinite
+        on the subgraph), so that a customization is proportional to the subgraph """
+        hierarchy = copy.copy(self)
+        node_mask = np.zeros(len(self.rank), dtype=bool)
+        arcs = self.edge_slot[edges] // 2
+        arcs = arcs[arcs >= 0]
+        node_mask[self.arc_tail[arcs]] = node_mask[self.arc_head[arcs]] = True
+        arc_mask = node_mask[self.arc_tail] & node_mask[self.arc_head]
+        left, right, targets, level = self.triangles
+        keep = arc_mask[left // 2] & arc_mask[right // 2]
+        hierarchy.triangles = left[keep], right[keep], targets[keep], level[keep]
+        hierarchy.levels = split_levels(*hierarchy.triangles)
+        hierarchy.edges = edges
+        hierarchy.allocate()
+        return hierarchy
+
+    def customize(self, weight):
+        """ weights of the arcs for the edge weight (non-negative)
+        of the edges of restrict (the other edges are removed), or of all the edges """
+        if self.edges is not None:
+            edge_weight = np.full(self.num_edges, np.inf)
+            edge_weight[self.edges] = weight
+        else:
+            edge_weight = np.asarray(weight, dtype=np.float64)
+        self.edge_weight = edge_weight
+        w = self.w
+        w.fill(np.inf)
+        if self.slot_edges.size:
+            w[self.edge_slots] = np.minimum.reduceat(edge_weight[self.slot_edges], self.edge_starts)
+        for left, right, slots, starts in self.levels:
+            w[slots] = np.minimum(w[slots], np.minimum.reduceat(w[left] + w[right], starts))
+
+    def upward_search(self, node, direction):
+        """ distances of the ancestors of node (from node if direction is 0, to node if 1) """
+        indptr, arc_head, w = self.indptr, self.arc_head, self.w[direction::2]
+        distance, predecessor = self.distance[direction], self.predecessor[direction]
+        ancestors = []
+        distance[node] = 0
+        v = node
+        while v != -1:
+            ancestors.append(v)
+            start, end = indptr[v], indptr[v+1]
+            if start == end:
+                break
+            heads = arc_head[start:end]
+            candidate = distance[v] + w[start:end]
+            improved = candidate < distance[heads]
+            distance[heads[improved]] = candidate[improved]
+            predecessor[heads[improved]] = np.arange(start, end)[improved]
+            v = heads[0] # the parent in the elimination tree
+        return ancestors
+
+    def path(self, source, target):
+        """ edge ids of the shortest source - target path on the customized weight
+        (indices of the edges of restrict if restricted) """
+        forward = self.upward_search(source, 0)
+        backward = self.upward_search(target, 1)
+        self.num_settled = len(forward) + len(backward)
+        ancestors = np.array(forward)
+        total = self.distance[0][ancestors] + self.distance[1][ancestors]
+        meet = int(ancestors[np.argmin(total)])
+        if total.min() == np.inf:
+            self.reset(forward, backward)
+            raise nx.NetworkXNoPath(f'node {target} not reachable from {source}')
+        slots = []
+        v = meet
+        while v != source:
+            a = int(self.predecessor[0][v])
+            slots.append(2*a)
+            v = int(self.arc_tail[a])
+        slots.reverse()
+        v = meet
+        while v != target:
+            a = int(self.predecessor[1][v])
+            slots.append(2*a+1)
+            v = int(self.arc_tail[a])
+        self.reset(forward, backward)
+        path_edges = [e for slot in slots for e in self.unpack(slot)]
+        if self.edges is not None:
+            return np.searchsorted(self.edges, path_edges).tolist()
+        return path_edges
+
+    def reset(self, forward, backward):
+        for direction, ancestors in enumerate((forward, backward)):
+            self.distance[direction][ancestors] = np.inf
+            self.predecessor[direction][ancestors] = -1
+
+    def unpack(self, slot):
+        """ edge ids of the path of the slot (an edge or the two slots of a lower triangle) """
+        w, edge_weight = self.w, self.edge_weight
+        path_edges = []
+        stack = [slot]
+        while stack:
+            slot = stack.pop()
+            value = w[slot]
+            for e in self.slot_edges[self.slot_indptr[slot]:self.slot_indptr[slot+1]]:
+                if edge_weight[e] == value:
+                    path_edges.append(int(e))
+                    break
+            else:
+                a, downward = divmod(slot, 2)
+                y, z = int(self.arc_tail[a]), int(self.arc_head[a])
+                lower = {int(self.arc_tail[arc]): int(arc) for arc in
+                         self.down_arcs[self.down_indptr[y]:self.down_indptr[y+1]]}
+                for xz in self.down_arcs[self.down_indptr[z]:self.down_indptr[z+1]]:
+                    xz = int(xz)
+                    xy = lower.get(int(self.arc_tail[xz]))
+                    if xy is None:
+                        continue
+                    if not downward and w[2*xy+1] + w[2*xz] == value:
+                        # y -> x, x -> z
+                        stack += [2*xz, 2*xy+1]
+                        break
+                    if downward and w[2*xz+1] + w[2*xy] == value:
+                        # z -> x, x -> y
+                        stack += [2*xy, 2*xz+1]
+                        break
+        return path_edges
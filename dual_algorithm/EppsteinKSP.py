@@ -1,143 +1,198 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import networkx as nx
-from copy import deepcopy
 from heapq import heappush, heappop
 
-from ShortestPath import shortest_path_bf
+from CSRGraph import CSRGraph
+from ShortestPath import ShortestPathBuffer, ReverseDijkstra, ReverseBellmanFordCSR
 from heap_tree import BinaryTree
 
-def EppsteinKSP(MultiGraph, source, target, weight):
-    """ generator k shortest path """
-    pred, distance = nx.dijkstra_predecessor_and_distance(MultiGraph.reverse(), source=target, weight=weight)
-    # shortest path tree
-    T = nx.MultiDiGraph()
-    for tail, heads in pred.items():
-        if heads:
-            head = heads[0]
-            min_key = min(MultiGraph[tail][head], key=lambda edge_key: MultiGraph[tail][head][edge_key][weight])
-            edge_weight = MultiGraph[tail][head][min_key][weight]
-            T.add_edge(tail, head, weight=edge_weight, key=min_key)
-
-    # calc potential of edge
-    for tail in MultiGraph:
-        for head, edges in MultiGraph[tail].items():
-            for key in edges:
-                edges[key]['delta'] = edges[key][weight] + distance[head] - distance[tail]
-
-    # generate H_out tree
-    def out(tail):
-        out_edges = []
-        for head, edges in MultiGraph[v].items():
-            for key in edges:
-                if head not in T[tail] or key not in T[tail][head]:
-                    out_edges.append((tail, head, key))
-        return out_edges
-
-    for v in MultiGraph:
-        out_edges = sorted(out(v))
-        h_out_tree = BinaryTree()
-        if out_edges:
-            max_root, *other_edges = out_edges
-            for edge in other_edges:
-                h_out_tree.insert(edge, MultiGraph.edges[edge]['delta'])
-            h_out_tree.insert(max_root, MultiGraph.edges[max_root]['delta'])
-        MultiGraph.node[v]['H_out'] = h_out_tree
-
-    # generate H_T tree
-    h_t_tree = BinaryTree()
-    out_root = MultiGraph.node[target]['H_out'].root
-    if out_root is not None:
-        h_t_tree.insert(out_root.name, out_root.value)
-    MultiGraph.node[target]['H_T'] = h_t_tree
-    for edge in nx.bfs_edges(T.reverse(), source=target):
-        tail, head = edge
-        h_t_tree = deepcopy(MultiGraph.node[tail]['H_T'])
-        out_root = MultiGraph.node[head]['H_out'].root
-        if out_root is not None:
-            h_t_tree.insert(out_root.name, out_root.value)
-        MultiGraph.node[head]['H_T'] = h_t_tree
-
-    # generate H_G tree
-    h_g_tree = deepcopy(MultiGraph.node[target]['H_T'])
-    h_g_tree.h_out_insert(MultiGraph.node[target]['H_out'])
-    MultiGraph.node[target]['H_G'] = h_g_tree
-    for edge in nx.bfs_edges(T.reverse(), source=target):
-        _, child = edge
-        h_g_tree = MultiGraph.node[child]['H_T']
-        for v in nx.shortest_path(T, source=child, target=target):
-            h_g_tree.h_out_insert(MultiGraph.node[v]['H_out'])
-        MultiGraph.node[child]['H_G'] = h_g_tree
-
-    # generate path-graph P
-    def edge2delta(edge):
-        tail, head, key = edge
-        return MultiGraph[tail][head][key]['delta']
-
-    def add_H_G_to_P(node):
-        for v in MultiGraph.node[node]['H_G'].traverse():
-            v_name = (node, v.name)
-            P.add_node(v_name)
-            if v.left  is not None:
-                u_name = (node, v.left.name)
-                edge_weight = edge2delta(v.left.name) - edge2delta(v.name)
-                P.add_edge(v_name, u_name, weight=edge_weight, edge_type='heap_edge')
-            if v.right is not None:
-                u_name = (node, v.right.name)
-                edge_weight = edge2delta(v.right.name) - edge2delta(v.name)
-                P.add_edge(v_name, u_name, weight=edge_weight, edge_type='heap_edge')
-            if v.h_out is not None:
-                u_name = (node, v.h_out.name)
-                edge_weight = edge2delta(v.h_out.name) - edge2delta(v.name)
-                P.add_edge(v_name, u_name, weight=edge_weight, edge_type='heap_edge')
-
-    ## add heap edges
-    P = nx.DiGraph()    
-    add_H_G_to_P(target)
-    for edge in nx.bfs_edges(T.reverse(), source=target):
-        _, child = edge
-        add_H_G_to_P(child)
-
-    ## add cross edges
-    for v in P:
-        _, edge = v
-        tail, head, key = edge
-        if head not in T[tail] or key not in T[tail][head]:
-            _, w, key = edge
-            if MultiGraph.node[w]['H_G'].root is not None:
-                u_name = (w, MultiGraph.node[w]['H_G'].root.name)
-                edge_weight = edge2delta(MultiGraph.node[w]['H_G'].root.name)
-                P.add_edge(v, u_name, weight=edge_weight, edge_type='cross_edge')
-
-    ## add root node
-    P.add_node('RootNode')
-    u = (source, MultiGraph.node[source]['H_G'].root.name)
-    edge_weight = edge2delta(MultiGraph.node[source]['H_G'].root.name)
-    P.add_edge('RootNode', u, weight=edge_weight, edge_type='root_edge')
-    
-    # find K - shortest path
-    def sidetracks2path(sidetracks, source, target, minus_weight):
-        tmp_T = T.copy()
-        for v, u in sidetracks[1:]:
-            if P[v][u]['edge_type'] == 'cross_edge':
-                tail, head, key = v[1]
-                tmp_T.add_edge(tail, head, key=key, weight=minus_weight)
-        if len(sidetracks) > 1:
-            _, last_sidetracks = sidetracks[-1]
-            tail, head, key = last_sidetracks[1]
-            tmp_T.add_edge(tail, head, key=key, weight=minus_weight)
-        _, shortest_path_edges = shortest_path_bf(tmp_T, source, target, weight='weight')
-        return shortest_path_edges
-
-    minus_weight = -sum(abs(edge_data['weight']) for tail, head in T.edges() for edge_data in T[tail][head].values())
-    B = [(0, [(None, 'RootNode')])]
-    while B:
-        potentials, sidetracks = heappop(B)
-        path_edges = sidetracks2path(sidetracks, source, target, minus_weight) 
-        yield None, path_edges
-        _, last_sidetracks = sidetracks[-1]
-        for v in P[last_sidetracks]:
-            new_sidetracks = sidetracks + [(last_sidetracks, v)]
-            new_potentials = potentials + P.edges[last_sidetracks, v]['weight']
-            heappush(B, (new_potentials, new_sidetracks))
+
+class EppsteinPathGraph:
+    """ shortest path tree to target and the heaps H_out, H_G of the path-graph P
+    on a CSRGraph and a weight array
+
+    the object is not changed by the k shortest path search, so it is reused by
+    the searches from any source to the same target on the same weight
+    (H_out and H_G are built when a search reaches them and kept for the next ones)
+    names of the heap nodes are edge ids
+    """
+
+    def __init__(self, graph, target, weight):
+        self.graph = graph
+        self.target = target
+        buffer = ShortestPathBuffer(graph)
+        self.indptr, self.tails, self.heads = buffer.indptr, buffer.tails, buffer.heads
+        self.w = weight.tolist()
+        if weight.size == 0 or weight.min() >= 0:
+            ReverseDijkstra(buffer, target, self.w)
+        else:
+            ReverseBellmanFordCSR(buffer, target, self.w)
+        # distance to target and the tree edge out of each node
+        # (next_edge is -1 for target and the nodes which do not reach target)
+        self.distance = buffer.distance
+        self.next_edge = buffer.predecessor
+        self.H_out = dict()
+        self.H_G = dict()
+        self._tree_sums = None
+
+    # potential of edge
+    def delta(self, e):
+        return self.w[e] + self.distance[self.heads[e]] - self.distance[self.tails[e]]
+
+    # H_out tree: sidetracks out of v, the root (minimum sidetrack) has only one child
+    def h_out(self, v):
+        if v not in self.H_out:
+            out_edges = [e for e in range(self.indptr[v], self.indptr[v+1])
+                         if e != self.next_edge[v] and self.distance[self.heads[e]] < float('inf')]
+            h_out_tree = BinaryTree()
+            if out_edges:
+                out_edges.sort(key=self.delta)
+                min_root, *other_edges = out_edges
+                for e in other_edges:
+                    h_out_tree.insert(e, self.delta(e))
+                h_out_tree.root_insert(min_root, self.delta(min_root))
+            self.H_out[v] = h_out_tree
+        return self.H_out[v]
+
+    # H_G tree: H_out roots of the tree path from v to target, each with the rest of its H_out
+    def h_g(self, v):
+        H_G, next_edge, heads = self.H_G, self.next_edge, self.heads
+        tree_path = []
+        while v not in H_G:
+            tree_path.append(v)
+            if v == self.target:
+                break
+            v = heads[next_edge[v]]
+        for v in reversed(tree_path):
+            # H_G(v) shares all but O(log n) nodes with H_G of the tree successor
+            h_g_tree = BinaryTree() if v == self.target else H_G[heads[next_edge[v]]]
+            h_out_tree = self.h_out(v)
+            if h_out_tree.root is not None:
+                h_g_tree = h_g_tree.persistent_insert(h_out_tree.root.name, h_out_tree.root.value)
+                h_g_tree.h_out_insert(h_out_tree)
+            H_G[v] = h_g_tree
+        return H_G[v]
+
+    @property
+    def tree_sums(self):
+        """ c and t of the tree path from each node to target (lists) """
+        if self._tree_sums is None:
+            next_edge, heads = self.next_edge, self.heads
+            c, t = self.graph.c.tolist(), self.graph.t.tolist()
+            num_nodes = len(self.distance)
+            tree_c, tree_t = [0.0] * num_nodes, [0.0] * num_nodes
+            is_done = [False] * num_nodes
+            is_done[self.target] = True
+            for node in range(num_nodes):
+                tree_path = []
+                v = node
+                while not is_done[v] and next_edge[v] != -1:
+                    tree_path.append(v)
+                    v = heads[next_edge[v]]
+                for v in reversed(tree_path):
+                    e = next_edge[v]
+                    tree_c[v] = c[e] + tree_c[heads[e]]
+                    tree_t[v] = t[e] + tree_t[heads[e]]
+                    is_done[v] = True
+            self._tree_sums = tree_c, tree_t
+        return self._tree_sums
+
+    def path(self, source, sidetracks):
+        """ edge ids of the path from source which leaves the tree at sidetracks """
+        next_edge, tails, heads = self.next_edge, self.tails, self.heads
+        path_edges = []
+        v = source
+        for sidetrack in sidetracks + [None]:
+            # follow the tree edges to the tail of the sidetrack
+            tail = self.target if sidetrack is None else tails[sidetrack]
+            while v != tail:
+                path_edges.append(next_edge[v])
+                v = heads[next_edge[v]]
+            if sidetrack is not None:
+                path_edges.append(sidetrack)
+                v = heads[sidetrack]
+        return path_edges
+
+    def paths(self, source, sidetracks_only=False, prune=None, metrics=None):
+        """ generator k shortest path from source (lists of edge ids)
+        sidetracks_only: generate (path length, sidetrack edge ids) instead,
+        without reconstructing the path
+        prune: prune(v, c, t) is True if no path which reaches node v with the
+        sums c, t of graph.c, graph.t is needed, the paths which leave the tree
+        at such a prefix are not searched (the paths which are popped are still
+        generated in order, so that the caller can stop on the length of the last one)
+        metrics: Metrics which counts the heap pushes and pops (optional) """
+        if self.distance[source] == float('inf'):
+            return
+        if prune is not None:
+            tree_c, tree_t = self.tree_sums
+            c, t = self.graph.c.tolist(), self.graph.t.tolist()
+            tails, heads = self.tails, self.heads
+
+        def chain2list(chain):
+            sidetracks = []
+            while chain is not None:
+                edge, chain = chain
+                sidetracks.append(edge)
+            return sidetracks[::-1]
+
+        # B: (potential, count, node of P, sidetracks before node as linked list (edge, prev),
+        #     prefix (v, c, t): head of the last sidetrack before node and the sums of the path to it)
+        # node of P is a node of some H_G tree, None is the root of P (the shortest path)
+        count = 0
+        B = [(0, count, None, None, (source, 0.0, 0.0))]
+        num_pops = 0
+        try:
+            while B:
+                potential, _, node, chain, prefix = heappop(B)
+                num_pops += 1
+                sidetracks = [] if node is None else chain2list(chain) + [node.name]
+                if sidetracks_only:
+                    yield self.distance[source] + potential, sidetracks
+                else:
+                    yield self.path(source, sidetracks)
+                is_pruned = False
+                if prune is not None and node is not None:
+                    # prefix up to the head of the sidetrack of node
+                    prefix_v, prefix_c, prefix_t = prefix
+                    e, v = node.name, heads[node.name]
+                    path_c = prefix_c + tree_c[prefix_v] - tree_c[tails[e]] + c[e]
+                    path_t = prefix_t + tree_t[prefix_v] - tree_t[tails[e]] + t[e]
+                    is_pruned = prune(v, path_c, path_t)
+                if node is None:
+                    # root edge
+                    next_nodes = [(self.h_g(source).root, chain, prefix, 0)]
+                else:
+                    # heap edges
+                    next_nodes = [(child, chain, prefix, potential - node.value) for child in (node.left, node.right, node.h_out)]
+                    # cross edge (the paths below it extend the prefix of node)
+                    if not is_pruned:
+                        next_prefix = (v, path_c, path_t) if prune is not None else None
+                        next_nodes.append((self.h_g(self.heads[node.name]).root, (node.name, chain), next_prefix, potential))
+                for next_node, next_chain, next_prefix, base in next_nodes:
+                    if next_node is None:
+                        continue
+                    count += 1
+                    heappush(B, (base + next_node.value, count, next_node, next_chain, next_prefix))
+        finally:
+            if metrics is not None:
+                metrics.count('ksp_heap_pushes', count+1)
+                metrics.count('ksp_heap_pops', num_pops)
+
+
+def EppsteinKSP(MultiGraph, source, target, weight, sidetracks_only=False):
+    """ generator k shortest path
+    MultiGraph: networkx multipul directed graph (it is not changed)
+
+    sidetracks_only: generate (path length, sidetrack edges) instead of
+    (path nodes, path edges) without reconstructing the path
+    """
+    graph = CSRGraph.from_networkx(MultiGraph, weight=weight, cost=weight)
+    path_graph = EppsteinPathGraph(graph, graph.node_index[target], graph.c)
+    for path in path_graph.paths(graph.node_index[source], sidetracks_only):
+        if sidetracks_only:
+            length, sidetracks = path
+            yield length, graph.path_edges(sidetracks)
+        else:
+            yield [source] + [graph.nodes[graph.heads[e]] for e in path], graph.path_edges(path)
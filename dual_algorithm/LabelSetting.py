@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from heapq import heappush, heappop
+
+
+def LabelSettingCSP(graph, source, target, upper_bound, c_to_target, t_to_target, UB=float('inf'), metrics=None,
+                    limit=None):
+    """ bi-criteria label setting algorithm of the constrained shortest path on the CSRGraph
+    edge ids of the shortest path on graph.c whose sum of graph.t is at most upper_bound
+    (None if there is no such path shorter than UB)
+
+    c_to_target, t_to_target: shortest distance to target of every node on c and on t
+    the labels (c, t) are popped in the order of c + c_to_target (a feasible potential,
+    so the first label of target is optimal) and a label is dropped when
+        - it can not reach target within upper_bound (t + t_to_target),
+        - it can not reach target shorter than UB (c + c_to_target),
+        - it is dominated by a popped label of the same node (all of them have smaller c,
+          so it is dominated iff its t is not smaller than their minimum)
+    metrics: Metrics which counts the labels (optional)
+    limit: function of (lower bound, the number of popped labels) called for every popped label,
+        the search stops if it returns a status (None to go on) (optional)
+        the key of the popped label is a lower bound of the shortest path shorter than UB
+    return path, status (status is the one of limit if it stopped the search, else None)
+    """
+    indptr, heads = graph.indptr.tolist(), graph.heads.tolist()
+    c, t = graph.c.tolist(), graph.t.tolist()
+    tolerance = 1e-9 * (1 + abs(upper_bound))
+    if t_to_target[source] > upper_bound + tolerance or c_to_target[source] >= UB:
+        return None, None
+
+    # label i: the edge into its node and the label before it
+    label_edge, label_parent = [-1], [-1]
+    # minimum t of the popped labels of each node
+    min_t = [float('inf')] * graph.number_of_nodes()
+    que = [(c_to_target[source], 0.0, 0.0, source, 0)]
+    num_popped = 0
+    while que:
+        key, label_t, label_c, v, label = heappop(que)
+        if label_t >= min_t[v]:
+            continue
+        min_t[v] = label_t
+        if v == target:
+            if metrics is not None:
+                metrics.count('labels', len(label_edge))
+            path_edges = []
+            while label_edge[label] != -1:
+                path_edges.append(label_edge[label])
+                label = label_parent[label]
+            return path_edges[::-1], None
+        num_popped += 1
+        if limit is not None:
+            status = limit(key, num_popped)
+            if status is not None:
+                if metrics is not None:
+                    metrics.count('labels', len(label_edge))
+                return None, status
+        for e in range(indptr[v], indptr[v+1]):
+            head = heads[e]
+            next_c, next_t = label_c + c[e], label_t + t[e]
+            if next_t >= min_t[head]\
+            or next_t + t_to_target[head] > upper_bound + tolerance\
+            or next_c + c_to_target[head] >= UB:
+                continue
+            label_edge.append(e)
+            label_parent.append(label)
+            heappush(que, (next_c + c_to_target[head], next_t, next_c, head, len(label_edge)-1))
+    if metrics is not None:
+        metrics.count('labels', len(label_edge))
+    return None, None
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import time
+from collections import defaultdict
+
+
+class Metrics:
+    """ wall times of the stages and the counters of one solve
+
+    times: stage -> seconds (step0, ..., step4, contraction (--ch) and total)
+    counts: counter -> number, e.g.
+        shortest_path_solves, settled_nodes (of the Dijkstra solves or the hierarchy queries),
+        step3_iterations, step4_iterations, ksp_paths (k shortest paths consumed),
+        ksp_heap_pushes, ksp_heap_pops, spur_searches (Yen), labels (label setting)
+    status: optimal, infeasible, or the limit which stopped the search
+            (time_limit, path_limit, gap), LB and UB are the bounds proven at the end
+    """
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.status = None
+        self.LB = self.UB = None
+        self.stage = None
+        self._start_time = None
+        self._stage_time = None
+
+    def start(self, stage):
+        """ start stage (the previous stage is stopped) """
+        now = time.perf_counter()
+        if self._start_time is None:
+            self._start_time = now
+        elif self.stage is not None:
+            self.times[self.stage] += now - self._stage_time
+        self.stage, self._stage_time = stage, now
+
+    def stop(self):
+        """ stop the current stage and the total timer """
+        if self._start_time is None:
+            return
+        now = time.perf_counter()
+        if self.stage is not None:
+            self.times[self.stage] += now - self._stage_time
+        self.times['total'] += now - self._start_time
+        self.stage = self._start_time = self._stage_time = None
+
+    def count(self, counter, num=1):
+        self.counts[counter] += num
+
+    def as_dict(self):
+        return {'status': self.status, 'LB': self.LB, 'UB': self.UB,
+                'times': dict(self.times), 'counts': dict(self.counts)}
+
+    def write(self, f, **info):
+        """ write the metrics as one JSON line (with the items of info) """
+        print(json.dumps(dict(info, **self.as_dict())), file=f, flush=True)
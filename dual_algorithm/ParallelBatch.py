@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from CSRGraph import CSRGraph
+from ContractionHierarchy import ContractionHierarchy
+from QueryCache import QueryCache
+from dual_algorithm import solve_batch
+
+
+# graph, query cache and options of the worker process (set by init_worker)
+worker_graph = None
+worker_cache = None
+worker_options = None
+
+
+def init_worker(graph_file, edge_file, options):
+    """ open the binary graph file in the worker process
+    (the arrays are memory-mapped read only, so the workers share the pages of the graph,
+    and the query cache indexes them in place)
+    edge_file: graph file of the contraction hierarchy file (None if it is not cached) """
+    global worker_graph, worker_cache, worker_options
+    worker_graph = CSRGraph.load(graph_file)
+    worker_cache = QueryCache(worker_graph, mapped=True, edge_file=edge_file)
+    worker_options = options
+
+
+def solve_chunk(queries):
+    return list(solve_batch(worker_graph, queries, worker_options, worker_cache))
+
+
+def chunks(queries, chunk_size):
+    queries = iter(queries)
+    while True:
+        chunk = list(islice(queries, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def solve_batch_parallel(edge_file, queries, options, workers=None, chunk_size=16):
+    """ generator of (query, (opt_path, path_length, cost_length), metrics) for each query
+    the queries are solved by chunks of chunk_size on workers processes,
+    and the results are generated in the order of queries """
+    graph = CSRGraph.read(edge_file, cache=options.cache)
+    graph_file, tmp_file = edge_file + '.csrg', None
+    if not (options.cache and os.path.exists(graph_file)):
+        # the workers need a binary graph file to memory-map
+        fd, tmp_file = tempfile.mkstemp(suffix='.csrg')
+        os.close(fd)
+        graph.save(tmp_file)
+        graph_file = tmp_file
+    hierarchy_file = None
+    if options.contraction_hierarchy and options.cache:
+        # the contraction hierarchy file is written once, the workers read it
+        hierarchy_file = edge_file
+        try:
+            ContractionHierarchy.read(graph, edge_file)
+        except ValueError:
+            pass
+    try:
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(graph_file, hierarchy_file, options)) as executor:
+            for results in executor.map(solve_chunk, chunks(queries, chunk_size)):
+                yield from results
+    finally:
+        if tmp_file is not None:
+            os.remove(tmp_file)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import numpy as np
+from heapq import heappush, heappop, heapify
+
+from ShortestPath import ShortestPathBuffer, Dijkstra
+
+
+class ParametricShortestPath:
+    """ parametric shortest path on the lagrangian weight c + u*t
+
+    the shortest path tree at u stays optimal while the reduced cost
+        (c_e + dc[tail] - dc[head]) + u * (t_e + dt[tail] - dt[head])
+    of every edge e is non-negative (dc, dt: c and t length of the tree path),
+    so the breakpoints of L(u) are obtained from the tree labels and the tree
+    is updated by pivoting one edge instead of solving the shortest path again
+    """
+
+    def __init__(self, graph, source, target, buffer=None, epsilon=1e-9):
+        self.graph = graph
+        self.source = source
+        self.target = target
+        self.buffer = ShortestPathBuffer(graph) if buffer is None else buffer
+        self.epsilon = epsilon
+        self.rev_indptr = graph.rev_indptr.tolist()
+        self.rev_edges = graph.rev_edges.tolist()
+        self.num_solves = 0
+        self.num_breakpoints = 0 # tree pivots
+        self.num_pieces = 0      # changes of the source - target path
+        self.status = None       # status of the limit which stopped the last search
+
+    def solve(self, u):
+        """ shortest path tree and its labels for the weight c + u*t """
+        graph, buffer = self.graph, self.buffer
+        buffer.reset()
+        Dijkstra(buffer, self.source, None, graph.weight(u).tolist())
+        self.num_solves += 1
+
+        num_nodes = graph.number_of_nodes()
+        tails, c, t = buffer.tails, graph.c.tolist(), graph.t.tolist()
+        self.predecessor = list(buffer.predecessor)
+        self.children = [[] for _ in range(num_nodes)]
+        dc = [float('inf')] * num_nodes
+        dt = [float('inf')] * num_nodes
+        dc[self.source] = dt[self.source] = 0
+        for v in buffer.settled[1:]:
+            e = self.predecessor[v]
+            dc[v] = dc[tails[e]] + c[e]
+            dt[v] = dt[tails[e]] + t[e]
+            self.children[tails[e]].append(v)
+        self.dc, self.dt = np.array(dc), np.array(dt)
+
+        # reduced costs (edges whose tail is not reachable never enter the tree)
+        self.is_active = np.isfinite(self.dc[graph.tails])
+        tails, heads = graph.tails[self.is_active], graph.heads[self.is_active]
+        self.rc_c = np.zeros(graph.number_of_edges())
+        self.rc_t = np.zeros(graph.number_of_edges())
+        self.rc_c[self.is_active] = graph.c[self.is_active] + self.dc[tails] - self.dc[heads]
+        self.rc_t[self.is_active] = graph.t[self.is_active] + self.dt[tails] - self.dt[heads]
+        self.is_tree = np.zeros(graph.number_of_edges(), dtype=bool)
+        self.is_tree[[e for e in self.predecessor if e >= 0]] = True
+
+    def path(self):
+        path_edges = []
+        v = self.target
+        while v != self.source:
+            e = self.predecessor[v]
+            path_edges.append(e)
+            v = self.buffer.tails[e]
+        return path_edges[::-1]
+
+    def breakpoints_of(self, edges, direction):
+        """ breakpoints (direction * u, direction * slope, edge, version) of the
+        edges whose reduced cost decreases in the direction """
+        edges = edges[self.is_active[edges] & ~self.is_tree[edges]]
+        slope = direction * self.rc_t[edges]
+        edges, slope = edges[slope < -self.epsilon], slope[slope < -self.epsilon]
+        ratio = -self.rc_c[edges] / slope
+        # the steepest edge keeps the tree optimal just after the breakpoint
+        return list(zip(ratio.tolist(), slope.tolist(), edges.tolist(), self.version[edges].tolist()))
+
+    def next_breakpoint(self, u, direction):
+        """ the edge which enters the tree at the next breakpoint in the direction
+        return (None, None) if the tree is optimal for all the remaining u """
+        breakpoints, version, is_tree = self.breakpoints, self.version, self.is_tree
+        while breakpoints:
+            ratio, _, e, v = heappop(breakpoints)
+            if v != version[e] or is_tree[e]:
+                continue
+            u_next = direction * ratio
+            return e, (max(u_next, u) if direction > 0 else min(u_next, u))
+        return None, None
+
+    def pivot(self, e, direction):
+        """ replace the tree edge into head of e by e
+        return the set of nodes whose tree path is changed """
+        tails, heads, indptr = self.buffer.tails, self.buffer.heads, self.buffer.indptr
+        rev_indptr, rev_edges = self.rev_indptr, self.rev_edges
+        tail, head = tails[e], heads[e]
+        subtree = [head]
+        for v in subtree:
+            subtree.extend(self.children[v])
+        subtree_set = set(subtree)
+        if tail in subtree_set:
+            raise RuntimeError(f'edge {e} makes a cycle in the shortest path tree')
+
+        old = self.predecessor[head]
+        self.children[tails[old]].remove(head)
+        self.children[tail].append(head)
+        self.predecessor[head] = e
+        self.is_tree[old] = False
+        self.is_tree[e] = True
+
+        delta_c, delta_t = self.rc_c[e], self.rc_t[e]
+        self.dc[subtree] += delta_c
+        self.dt[subtree] += delta_t
+
+        # only the reduced costs of the edges incident to the subtree change
+        out_edges, in_edges = [], []
+        for v in subtree:
+            out_edges.extend(range(indptr[v], indptr[v+1]))
+            in_edges.extend(rev_edges[rev_indptr[v]:rev_indptr[v+1]])
+        out_edges = np.array(out_edges, dtype=np.int64)
+        in_edges = np.array(in_edges, dtype=np.int64)
+        self.rc_c[out_edges] += delta_c
+        self.rc_t[out_edges] += delta_t
+        self.rc_c[in_edges] -= delta_c
+        self.rc_t[in_edges] -= delta_t
+        self.rc_c[e] = self.rc_t[e] = 0
+        changed = np.union1d(out_edges, in_edges)
+        self.version[changed] += 1
+        for breakpoint in self.breakpoints_of(changed, direction):
+            heappush(self.breakpoints, breakpoint)
+        return subtree_set
+
+    def search(self, u, upper_bound, max_pivots=None, limit=None):
+        """ walk the breakpoints of L(u) from u to the maximizer of L(u)
+        return u, path with t > upper_bound, path with t <= upper_bound
+        (both paths are the same path if its t equals upper_bound)
+        limit: function of (u, path) called at every piece of L(u) passed with its shortest path,
+            the search stops if it returns a status (None to go on) (optional)
+            then the status is kept in self.status and u, None, None are returned """
+        self.status = None
+        if max_pivots is None:
+            max_pivots = 10 * self.graph.number_of_edges()
+        self.solve(u)
+        path = self.path()
+        slope = self.dt[self.target] - upper_bound
+        if slope == 0:
+            return u, path, path
+        direction = 1 if slope > 0 else -1
+
+        self.version = np.zeros(self.graph.number_of_edges(), dtype=np.int64)
+        self.breakpoints = self.breakpoints_of(np.arange(self.graph.number_of_edges()), direction)
+        heapify(self.breakpoints)
+
+        for _ in range(max_pivots):
+            e, u_next = self.next_breakpoint(u, direction)
+            if e is None or (direction < 0 and u_next <= 0):
+                if direction > 0:
+                    raise RuntimeError('L(u) is not bounded above')
+                # the feasible path is optimal for u = 0
+                return 0, path, path
+            subtree = self.pivot(e, direction)
+            u = u_next
+            self.num_breakpoints += 1
+            if self.target not in subtree:
+                continue
+            self.num_pieces += 1
+            prev_path, path = path, self.path()
+            slope = self.dt[self.target] - upper_bound
+            if slope == 0:
+                return u, path, path
+            if direction > 0 and slope < 0:
+                return u, prev_path, path
+            if direction < 0 and slope > 0:
+                return u, path, prev_path
+            if limit is not None:
+                self.status = limit(u, path)
+                if self.status is not None:
+                    return u, None, None
+        raise RuntimeError(f'parametric search does not terminate in {max_pivots} pivots')
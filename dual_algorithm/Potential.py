@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import numpy as np
+
+from ShortestPath import ShortestPathBuffer, Dijkstra
+
+
+# lower bounds of the distance to target on the weight alpha*c + beta*t (alpha, beta >= 0)
+# for the A* search. Both potentials are consistent, i.e.
+#     potential[tail] <= w[e] + potential[head]    for every edge e
+
+
+class EuclideanPotential:
+    """ scaled euclidean distance from the node positions of the graph file
+
+    scale = min_e w[e] / |tail(e) - head(e)| makes the distance a lower bound
+    (the scale is 0 if some edge is shorter than its straight line)
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.length = np.hypot(graph.x[graph.tails] - graph.x[graph.heads],
+                               graph.y[graph.tails] - graph.y[graph.heads])
+        self.positive = self.length > 0
+
+    def potential(self, target, alpha, beta, nodes=None):
+        graph = self.graph
+        if not self.positive.any():
+            return [0.0] * (graph.number_of_nodes() if nodes is None else len(nodes))
+        weight = alpha * graph.c + beta * graph.t
+        scale = max((weight[self.positive] / self.length[self.positive]).min(), 0)
+        distance = np.hypot(graph.x - graph.x[target], graph.y - graph.y[target])
+        if nodes is not None:
+            distance = distance[nodes]
+        return (scale * distance).tolist()
+
+
+class LandmarkPotential:
+    """ ALT (A*, landmarks and triangle inequality) lower bounds
+
+        d(v, target) >= d(v, L) - d(target, L)
+        d(v, target) >= d(L, target) - d(L, v)
+
+    the distances from and to the landmarks are computed once on c and on t,
+    and for alpha*c + beta*t the bound alpha*(bound on c) + beta*(bound on t) is used
+    """
+
+    def __init__(self, graph, num_landmarks=4, landmarks=None):
+        self.graph = graph
+        buffer = ShortestPathBuffer(graph)
+        reverse_buffer = ShortestPathBuffer(graph.reverse())
+
+        def distances(buffer, source, weight):
+            buffer.reset()
+            Dijkstra(buffer, source, None, weight)
+            return np.array(buffer.distance)
+
+        def landmark_distances(landmark):
+            # (from landmark, to landmark) on c and on t
+            return {key: (distances(buffer, landmark, weight_list[key]),
+                          distances(reverse_buffer, landmark, reverse_weight_list[key]))
+                    for key in ('c', 't')}
+
+        reverse = reverse_buffer.graph
+        weight_list = {'c': graph.c.tolist(), 't': graph.t.tolist()}
+        reverse_weight_list = {'c': reverse.c.tolist(), 't': reverse.t.tolist()}
+
+        self.distances = []
+        if landmarks is None:
+            # farthest landmark selection on c
+            landmarks = []
+            closest = np.full(graph.number_of_nodes(), np.inf)
+            v = 0
+            for _ in range(min(num_landmarks, graph.number_of_nodes())):
+                landmarks.append(v)
+                self.distances.append(landmark_distances(v))
+                from_landmark, to_landmark = self.distances[-1]['c']
+                closest = np.minimum(closest, np.minimum(from_landmark, to_landmark))
+                closest[landmarks] = -1
+                candidates = np.where(np.isfinite(closest), closest, -1)
+                v = int(np.argmax(candidates))
+                if candidates[v] <= 0:
+                    break
+        else:
+            self.distances = [landmark_distances(v) for v in landmarks]
+        self.landmarks = landmarks
+
+    def bound(self, target, key, nodes=None):
+        bound = np.zeros(self.graph.number_of_nodes() if nodes is None else len(nodes))
+        with np.errstate(invalid='ignore'):
+            for distances in self.distances:
+                from_landmark, to_landmark = distances[key]
+                from_nodes, to_nodes = (from_landmark, to_landmark) if nodes is None \
+                    else (from_landmark[nodes], to_landmark[nodes])
+                bound = np.fmax(bound, to_nodes - to_landmark[target])
+                bound = np.fmax(bound, from_landmark[target] - from_nodes)
+        return bound
+
+    def potential(self, target, alpha, beta, nodes=None):
+        """ nodes: node ids of a subgraph in graph (parent_nodes)
+        the bounds on graph are lower bounds on its subgraphs, so the potential of
+        the subgraph (indexed by its node ids) is taken from graph """
+        bound = np.zeros(self.graph.number_of_nodes() if nodes is None else len(nodes))
+        if alpha:
+            bound = bound + alpha * self.bound(target, 'c', nodes)
+        if beta:
+            bound = bound + beta * self.bound(target, 't', nodes)
+        return bound.tolist()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import networkx as nx
+import numpy as np
+from collections import OrderedDict
+
+from ShortestPath import ShortestPathBuffer, Dijkstra, ReverseDijkstra
+from ContractionHierarchy import ContractionHierarchy
+from Potential import LandmarkPotential
+
+
+class QueryCache:
+    """ precomputation shared by the queries on one CSRGraph
+
+    Step0 reachability and distances on t are kept per source and per target,
+    and the shortest path trees to target on c and on t (Step1 and Step2) per target,
+    so that queries which share a source or a target do not repeat them
+    (the least recently used entries are dropped beyond max_entries)
+    the contraction hierarchy of the graph (Step3) and the landmarks of the A* search
+    are built once for all the queries
+    """
+
+    def __init__(self, graph, max_entries=16, mapped=False, edge_file=None):
+        """ mapped: the arrays of a memory-mapped graph are used in place (not copied to lists)
+        edge_file: graph file of graph, the contraction hierarchy is kept in edge_file.cch
+                   (built for this cache only if None) """
+        self.graph = graph
+        self.edge_file = edge_file
+        self.max_entries = max_entries
+        self.buffer = ShortestPathBuffer(graph, mapped=mapped)
+        if mapped:
+            self.weight_list = {'c': np.asarray(graph.c), 't': np.asarray(graph.t)}
+        else:
+            self.weight_list = {'c': graph.c.tolist(), 't': graph.t.tolist()}
+        # the trees are Dijkstra trees, negative weights are left to the solver
+        self.nonnegative = {key: weight.size == 0 or weight.min() >= 0
+                            for key, weight in (('c', graph.c), ('t', graph.t))}
+        self.reachable_from = OrderedDict()
+        self.reachable_to = OrderedDict()
+        self.trees = OrderedDict()
+        self._contraction_hierarchy = None
+        self.landmarks = dict()
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def lookup(self, entries, key, compute):
+        if key in entries:
+            entries.move_to_end(key)
+            self.num_hits += 1
+            return entries[key]
+        self.num_misses += 1
+        value = entries[key] = compute()
+        if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+        return value
+
+    def reachable(self, node, reverse=False):
+        """ CSRGraph.reachable of node id """
+        entries = self.reachable_to if reverse else self.reachable_from
+        return self.lookup(entries, node, lambda: self.graph.reachable(node, reverse))
+
+    def tree(self, target, key, reverse=True):
+        """ distance to target and successor edge of every node on key ('c' or 't')
+        (distance from target and predecessor edge if not reverse) """
+        def compute():
+            buffer = self.buffer
+            buffer.reset()
+            if reverse:
+                ReverseDijkstra(buffer, target, self.weight_list[key])
+            else:
+                Dijkstra(buffer, target, -1, self.weight_list[key])
+            return np.array(buffer.distance), np.array(buffer.predecessor, dtype=np.int64)
+        return self.lookup(self.trees, (target, key, reverse), compute)
+
+    def contraction_hierarchy(self):
+        """ ContractionHierarchy of the graph (built or read on the first call)
+        the ValueError of a graph with too many triangles is raised again by the later calls """
+        if self._contraction_hierarchy is None:
+            try:
+                if self.edge_file is None:
+                    self._contraction_hierarchy = ContractionHierarchy(self.graph)
+                else:
+                    self._contraction_hierarchy = ContractionHierarchy.read(self.graph, self.edge_file)
+            except ValueError as e:
+                self._contraction_hierarchy = e
+        if isinstance(self._contraction_hierarchy, ValueError):
+            raise ValueError(*self._contraction_hierarchy.args)
+        return self._contraction_hierarchy
+
+    def landmark_potential(self, num_landmarks):
+        """ LandmarkPotential of the graph with num_landmarks landmarks (built on the first call) """
+        if num_landmarks not in self.landmarks:
+            self.landmarks[num_landmarks] = LandmarkPotential(self.graph, num_landmarks)
+        return self.landmarks[num_landmarks]
+
+    def shortest_path(self, source, target, key):
+        """ edge ids of the shortest source - target path on key ('c' or 't')
+        return None if the tree can not be shared (negative weights) """
+        if not self.nonnegative[key]:
+            return None
+        distance, successor = self.tree(target, key)
+        if distance[source] == np.inf:
+            raise nx.NetworkXNoPath(f'node {target} not reachable from {source}')
+        heads = self.buffer.heads
+        path_edges = []
+        v = source
+        while v != target:
+            e = int(successor[v])
+            path_edges.append(e)
+            v = heads[e]
+        return path_edges
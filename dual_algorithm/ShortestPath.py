@@ -2,6 +2,8 @@
 # coding: utf-8
 
 import networkx as nx
+import numpy as np
+from heapq import heappush, heappop
 
 def BellmanFord(MultiGraph, source, target, weight):
     """MultiGraph: networkx multipul directed graph"""
@@ -49,4 +51,405 @@ def shortest_path_bf(MultiGraph, source, target, weight):
             min_key = min(MultiGraph[tail][head], key=lambda edge_key: MultiGraph[tail][head][edge_key][weight])
             path_edges.append((tail, head, min_key))
     
-    return path_nodes, path_edges
\ No newline at end of file
+    return path_nodes, path_edges
+
+
+class ShortestPathBuffer:
+    """ preallocated distance and predecessor buffers for the CSRGraph solvers
+
+    the buffers are allocated once per graph and reused by every solve,
+    only the labels touched by the previous solve are reset
+    """
+
+    def __init__(self, graph, share=None, mapped=False):
+        if mapped:
+            # the arrays are indexed in place, so that the processes which memory-map
+            # the graph file share its pages instead of holding list copies of them
+            # (ndarray views, the items of a np.memmap are slower to index)
+            self.indptr, self.tails, self.heads, self.rev_indptr, self.rev_edges = (
+                np.asarray(array) for array in
+                (graph.indptr, graph.tails, graph.heads, graph.rev_indptr, graph.rev_edges))
+        elif share is None:
+            self.indptr = graph.indptr.tolist()
+            self.tails = graph.tails.tolist()
+            self.heads = graph.heads.tolist()
+            self.rev_indptr = graph.rev_indptr.tolist()
+            self.rev_edges = graph.rev_edges.tolist()
+        else:
+            # labels of their own on the adjacency lists of the other buffer
+            self.indptr, self.tails, self.heads = share.indptr, share.tails, share.heads
+            self.rev_indptr, self.rev_edges = share.rev_indptr, share.rev_edges
+        num_nodes = graph.number_of_nodes()
+        self.graph = graph
+        self.distance = [float('inf')] * num_nodes
+        self.predecessor = [-1] * num_nodes
+        self.visited = [False] * num_nodes
+        self.touched = []
+        self.settled = []
+        self.num_settled = 0 # nodes settled by the last shortest_path_csr
+        self._backward = None
+
+    @property
+    def backward(self):
+        """ labels for the backward search of the bidirectional Dijkstra """
+        if self._backward is None:
+            self._backward = ShortestPathBuffer(self.graph, share=self)
+        return self._backward
+
+    def reset(self):
+        distance, predecessor, visited = self.distance, self.predecessor, self.visited
+        for v in self.touched:
+            distance[v] = float('inf')
+            predecessor[v] = -1
+            visited[v] = False
+        self.touched = []
+        self.settled = []
+
+    def path(self, source, target):
+        """ edge ids of the source - target path in the predecessor buffer """
+        if self.distance[target] == float('inf'):
+            raise nx.NetworkXNoPath(f'node {target} not reachable from {source}')
+        path_edges = []
+        v = target
+        while v != source:
+            e = self.predecessor[v]
+            path_edges.append(e)
+            v = self.tails[e]
+        return path_edges[::-1]
+
+
+def Dijkstra(buffer, source, target, w):
+    """ w: list of non-negative edge weights """
+    indptr, heads = buffer.indptr, buffer.heads
+    distance, predecessor, visited = buffer.distance, buffer.predecessor, buffer.visited
+    touched, settled = buffer.touched, buffer.settled
+    distance[source] = 0
+    touched.append(source)
+    que = [(0, source)]
+    while que:
+        d, tail = heappop(que)
+        if visited[tail]:
+            continue
+        visited[tail] = True
+        settled.append(tail)
+        if tail == target:
+            break
+        for e in range(indptr[tail], indptr[tail+1]):
+            head = heads[e]
+            if d + w[e] < distance[head]:
+                if distance[head] == float('inf'):
+                    touched.append(head)
+                distance[head] = d + w[e]
+                predecessor[head] = e
+                heappush(que, (distance[head], head))
+
+
+def MaskedDijkstra(buffer, source, target, w, banned_edges, banned_nodes):
+    """ w: list of non-negative edge weights
+    banned_edges, banned_nodes: lists of bool, the search does not use
+    the banned edges and does not enter the banned nodes """
+    indptr, heads = buffer.indptr, buffer.heads
+    distance, predecessor, visited = buffer.distance, buffer.predecessor, buffer.visited
+    touched, settled = buffer.touched, buffer.settled
+    distance[source] = 0
+    touched.append(source)
+    que = [(0, source)]
+    while que:
+        d, tail = heappop(que)
+        if visited[tail]:
+            continue
+        visited[tail] = True
+        settled.append(tail)
+        if tail == target:
+            break
+        for e in range(indptr[tail], indptr[tail+1]):
+            head = heads[e]
+            if banned_edges[e] or banned_nodes[head]:
+                continue
+            if d + w[e] < distance[head]:
+                if distance[head] == float('inf'):
+                    touched.append(head)
+                distance[head] = d + w[e]
+                predecessor[head] = e
+                heappush(que, (distance[head], head))
+
+
+def AStar(buffer, source, target, w, potential):
+    """ w: list of non-negative edge weights
+    potential: list of the lower bounds of the distance to target,
+    which satisfies potential[tail] <= w[e] + potential[head] for every edge e """
+    indptr, heads = buffer.indptr, buffer.heads
+    distance, predecessor, visited = buffer.distance, buffer.predecessor, buffer.visited
+    touched, settled = buffer.touched, buffer.settled
+    distance[source] = 0
+    touched.append(source)
+    que = [(potential[source], source)]
+    while que:
+        _, tail = heappop(que)
+        if visited[tail]:
+            continue
+        visited[tail] = True
+        settled.append(tail)
+        if tail == target:
+            break
+        d = distance[tail]
+        for e in range(indptr[tail], indptr[tail+1]):
+            head = heads[e]
+            if d + w[e] < distance[head]:
+                if distance[head] == float('inf'):
+                    touched.append(head)
+                distance[head] = d + w[e]
+                predecessor[head] = e
+                heappush(que, (distance[head] + potential[head], head))
+
+
+def BidirectionalDijkstra(buffer, source, target, w):
+    """ w: list of non-negative edge weights
+    return the node where the forward and the backward search meet
+    (the forward labels are in buffer, the backward labels in buffer.backward) """
+    backward = buffer.backward
+    backward.reset()
+    indptr, tails, heads = buffer.indptr, buffer.tails, buffer.heads
+    rev_indptr, rev_edges = buffer.rev_indptr, buffer.rev_edges
+    distance_f, distance_b = buffer.distance, backward.distance
+    distance_f[source] = distance_b[target] = 0
+    buffer.touched.append(source)
+    backward.touched.append(target)
+    que_f, que_b = [(0, source)], [(0, target)]
+    mu, meet = (0, source) if source == target else (float('inf'), None)
+
+    while que_f and que_b and que_f[0][0] + que_b[0][0] < mu:
+        if que_f[0][0] <= que_b[0][0]:
+            # forward step on the out edges
+            d, tail = heappop(que_f)
+            if buffer.visited[tail]:
+                continue
+            buffer.visited[tail] = True
+            buffer.settled.append(tail)
+            for e in range(indptr[tail], indptr[tail+1]):
+                head = heads[e]
+                if d + w[e] < distance_f[head]:
+                    if distance_f[head] == float('inf'):
+                        buffer.touched.append(head)
+                    distance_f[head] = d + w[e]
+                    buffer.predecessor[head] = e
+                    heappush(que_f, (distance_f[head], head))
+                if distance_f[head] + distance_b[head] < mu:
+                    mu, meet = distance_f[head] + distance_b[head], head
+        else:
+            # backward step on the in edges
+            d, head = heappop(que_b)
+            if backward.visited[head]:
+                continue
+            backward.visited[head] = True
+            backward.settled.append(head)
+            for e in rev_edges[rev_indptr[head]:rev_indptr[head+1]]:
+                tail = tails[e]
+                if d + w[e] < distance_b[tail]:
+                    if distance_b[tail] == float('inf'):
+                        backward.touched.append(tail)
+                    distance_b[tail] = d + w[e]
+                    backward.predecessor[tail] = e
+                    heappush(que_b, (distance_b[tail], tail))
+                if distance_f[tail] + distance_b[tail] < mu:
+                    mu, meet = distance_f[tail] + distance_b[tail], tail
+    return meet
+
+
+def ReverseDijkstra(buffer, target, w):
+    """ w: list of non-negative edge weights
+    shortest path tree to target on the in edges
+    (distance is the distance to target, predecessor is the edge out of the node) """
+    rev_indptr, rev_edges, tails = buffer.rev_indptr, buffer.rev_edges, buffer.tails
+    distance, predecessor, visited = buffer.distance, buffer.predecessor, buffer.visited
+    touched, settled = buffer.touched, buffer.settled
+    distance[target] = 0
+    touched.append(target)
+    que = [(0, target)]
+    while que:
+        d, head = heappop(que)
+        if visited[head]:
+            continue
+        visited[head] = True
+        settled.append(head)
+        for e in rev_edges[rev_indptr[head]:rev_indptr[head+1]]:
+            tail = tails[e]
+            if d + w[e] < distance[tail]:
+                if distance[tail] == float('inf'):
+                    touched.append(tail)
+                distance[tail] = d + w[e]
+                predecessor[tail] = e
+                heappush(que, (distance[tail], tail))
+
+
+def BellmanFordCSR(buffer, source, w):
+    """ w: list of edge weights """
+    tails, heads = buffer.tails, buffer.heads
+    distance, predecessor = buffer.distance, buffer.predecessor
+    touched = buffer.touched
+    distance[source] = 0
+    touched.append(source)
+    for _ in range(len(distance)-1):
+        is_update = False
+        for e in range(len(w)):
+            if distance[tails[e]] + w[e] < distance[heads[e]]:
+                if distance[heads[e]] == float('inf'):
+                    touched.append(heads[e])
+                distance[heads[e]] = distance[tails[e]] + w[e]
+                predecessor[heads[e]] = e
+                is_update = True
+        if not is_update:
+            return
+    # an edge which is still relaxed is on a negative cycle (the predecessors have a cycle)
+    for e in range(len(w)):
+        if distance[tails[e]] + w[e] < distance[heads[e]]:
+            raise nx.NetworkXUnbounded('Negative cycle detected.')
+
+
+def ReverseBellmanFordCSR(buffer, target, w):
+    """ w: list of edge weights
+    shortest path tree to target (labels as ReverseDijkstra) """
+    tails, heads = buffer.tails, buffer.heads
+    distance, predecessor = buffer.distance, buffer.predecessor
+    touched = buffer.touched
+    distance[target] = 0
+    touched.append(target)
+    for _ in range(len(distance)-1):
+        is_update = False
+        for e in range(len(w)):
+            if distance[heads[e]] + w[e] < distance[tails[e]]:
+                if distance[tails[e]] == float('inf'):
+                    touched.append(tails[e])
+                distance[tails[e]] = distance[heads[e]] + w[e]
+                predecessor[tails[e]] = e
+                is_update = True
+        if not is_update:
+            return
+    for e in range(len(w)):
+        if distance[heads[e]] + w[e] < distance[tails[e]]:
+            raise nx.NetworkXUnbounded('Negative cycle detected.')
+
+
+def shortest_path_csr(graph, source, target, weight, buffer=None, potential=None, bidirectional=False):
+    """graph: CSRGraph, source, target: node id, weight: weight array of edges
+    buffer: ShortestPathBuffer of graph (allocated if None)
+    potential: lower bounds of the distance to target for A* search (list)
+    bidirectional: use the bidirectional Dijkstra
+    return the list of edge ids of the shortest path"""
+    if buffer is None:
+        buffer = ShortestPathBuffer(graph)
+    buffer.reset()
+    if weight.size > 0 and weight.min() < 0:
+        BellmanFordCSR(buffer, source, weight.tolist())
+        buffer.num_settled = len(buffer.touched)
+    elif potential is not None:
+        AStar(buffer, source, target, weight.tolist(), potential)
+        buffer.num_settled = len(buffer.settled)
+    elif bidirectional:
+        meet = BidirectionalDijkstra(buffer, source, target, weight.tolist())
+        buffer.num_settled = len(buffer.settled) + len(buffer.backward.settled)
+        if meet is None:
+            raise nx.NetworkXNoPath(f'node {target} not reachable from {source}')
+        path_edges = buffer.path(source, meet)
+        v = meet
+        while v != target:
+            e = buffer.backward.predecessor[v]
+            path_edges.append(e)
+            v = buffer.heads[e]
+        return path_edges
+    else:
+        Dijkstra(buffer, source, target, weight.tolist())
+        buffer.num_settled = len(buffer.settled)
+    return buffer.path(source, target)
+
+
+class WarmStartShortestPath:
+    """ single source shortest path tree of a CSRGraph which is repaired
+    from the previous tree when the edge weights change
+
+    the first solve (or a solve with negative weights) is a full Dijkstra,
+    the later solves move the old tree labels to the new weights and
+    re-settle only the nodes whose label is improved
+    """
+
+    def __init__(self, graph, source, buffer=None):
+        self.graph = graph
+        self.source = source
+        self.buffer = ShortestPathBuffer(graph) if buffer is None else buffer
+        self.order = None # settled nodes in topological order of the tree
+        self.depth = [0] * graph.number_of_nodes()
+        self.num_settled = 0
+
+    def solve(self, weight):
+        """ update the shortest path tree for the weight array """
+        if self.order is None or (weight.size > 0 and weight.min() < 0):
+            self.cold_solve(weight)
+        else:
+            self.repair(weight)
+
+    def cold_solve(self, weight):
+        buffer = self.buffer
+        buffer.reset()
+        if weight.size == 0 or weight.min() >= 0:
+            Dijkstra(buffer, self.source, None, weight.tolist())
+            self.num_settled = len(buffer.settled)
+            # depth of the new tree (settled order is topological)
+            for v in buffer.settled[1:]:
+                self.depth[v] = self.depth[buffer.tails[buffer.predecessor[v]]] + 1
+            self.update_order()
+        else:
+            BellmanFordCSR(buffer, self.source, weight.tolist())
+            self.num_settled = len(buffer.touched)
+            self.order = None
+
+    def repair(self, weight):
+        buffer = self.buffer
+        tails, heads, indptr = buffer.tails, buffer.heads, buffer.indptr
+        distance, predecessor = buffer.distance, buffer.predecessor
+        depth = self.depth
+        w = weight.tolist()
+
+        # labels of the old tree on the new weight (upper bounds)
+        for v in self.order[1:]:
+            e = predecessor[v]
+            distance[v] = distance[tails[e]] + w[e]
+
+        # edges which violate the optimality condition
+        d = np.array(distance)
+        violated = np.flatnonzero(d[self.graph.tails] + weight < d[self.graph.heads])
+        que = []
+        for e in violated.tolist():
+            tail, head = tails[e], heads[e]
+            if distance[tail] + w[e] < distance[head]:
+                distance[head] = distance[tail] + w[e]
+                predecessor[head] = e
+                depth[head] = depth[tail] + 1
+                heappush(que, (distance[head], head))
+
+        # re-settle the improved nodes and their descendants
+        num_settled = 0
+        while que:
+            dist, tail = heappop(que)
+            if dist > distance[tail]:
+                continue
+            num_settled += 1
+            for e in range(indptr[tail], indptr[tail+1]):
+                head = heads[e]
+                if dist + w[e] < distance[head]:
+                    distance[head] = dist + w[e]
+                    predecessor[head] = e
+                    depth[head] = depth[tail] + 1
+                    heappush(que, (distance[head], head))
+        self.num_settled = num_settled
+        if num_settled:
+            self.update_order()
+
+    def update_order(self):
+        # sort the reachable nodes by (distance, depth)
+        nodes = np.array(self.buffer.settled)
+        distance = np.array(self.buffer.distance)[nodes]
+        order = np.lexsort((np.array(self.depth)[nodes], distance))
+        self.order = nodes[order].tolist()
+
+    def path(self, target):
+        return self.buffer.path(self.source, target)
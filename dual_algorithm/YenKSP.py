@@ -1,67 +1,150 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import networkx as nx
+from concurrent.futures import ProcessPoolExecutor
 from heapq import heappush, heappop
 
-from ShortestPath import shortest_path_bf
+from CSRGraph import CSRGraph
+from ShortestPath import ShortestPathBuffer, MaskedDijkstra, BellmanFordCSR
 
 def YenKSP(MultiGraph, source, target, weight):
-    """ generator k shortest path """
-    #  Determine the shortest path from the source to the sink.
-    path_nodes, path_edges = shortest_path_bf(MultiGraph, source, target, weight)
-    yield path_nodes, path_edges
-    A = [{'node': path_nodes, 'edge': path_edges}]
-    # Initialize the set to store the potential kth shortest path.
-    B = list()
-
-    k = 0
-    while True:
-        # The spur node ranges from the first node to the next to last node in the previous (k+1)-shortest path.
-        for i in range(len(A[k]['node'])-1):
-            H = MultiGraph.copy()
-            # Spur node is retrieved from the previous k-shortest path, k âˆ’ 1.
-            spur_node = A[k]['node'][i]
-            # The sequence of nodes from the source to the spur node of the previous k-shortest path.
-            root_path_nodes = A[k]['node'][:i+1]
-            root_path_edges = A[k]['edge'][:i]
-
-            for path in A:
-                if root_path_edges == path['edge'][:i]:
-                    # Remove the links that are part of the previous shortest paths which share the same root path.
-                    # remove p.edge(i,i + 1) from Graph;
-                    tail, head, key = path['edge'][i]
-                    if head in H[tail] and key in H[tail][head]:
-                        H.remove_edge(tail, head, key=key)
-
-            # for each node rootPathNode in rootPath except spurNode:
-            #     remove rootPathNode from Graph;
-            for edge in root_path_edges:
-                tail, head, key = edge
-                H.remove_edge(tail, head, key=key)
-
-            try:
-                # Calculate the spur path from the spur node to the sink.
-                spur_path_nodes, spur_path_edges = shortest_path_bf(H, spur_node, target, weight)
-                # Entire path is made up of the root path and spur path.
-                total_path_nodes = root_path_nodes + spur_path_nodes[1:]
-                total_path_edges = root_path_edges + spur_path_edges
-                # Add the potential k-shortest path to the heap.
-                total_path_len = sum(MultiGraph[tail][head][key][weight] for tail, head, key in total_path_edges)
-                # total_path_len = sum(weights[weight] for _, _, weights in total_path_edges)
-                if (total_path_len, total_path_nodes, total_path_edges) not in B:
-                    heappush(B, (total_path_len, total_path_nodes, total_path_edges))
-            except:
-                pass
-
-        if not B:
-            # This handles the case of there being no spur paths, or no spur paths left.
-            # This could happen if the spur paths have already been exhausted (added to A),
-            # or there are no spur paths at all - such as when both the source and sink vertices
-            # lie along a "dead end".
-            break
-        # Add the lowest cost path becomes the k-shortest path.
-        path_data = heappop(B)
-        A.append({'node': path_data[1], 'edge': path_data[2]})
-        yield path_data[1], path_data[2]
-        k = k+ 1
+    """ generator k shortest path
+    MultiGraph: networkx multipul directed graph, generate (path nodes, path edges) """
+    graph = CSRGraph.from_networkx(MultiGraph, weight=weight, cost=weight)
+    for path in YenKSPCSR(graph, graph.node_index[source], graph.node_index[target], graph.c):
+        yield [source] + [graph.nodes[graph.heads[e]] for e in path], graph.path_edges(path)
+
+
+class SpurSearch:
+    """ spur path search on the arrays of the graph with banned edges and nodes
+    (instead of a copy of the graph without them) """
+
+    def __init__(self, graph, target, weight, buffer=None):
+        self.buffer = ShortestPathBuffer(graph) if buffer is None else buffer
+        self.target = target
+        self.w = weight.tolist()
+        self.negative = weight.size > 0 and weight.min() < 0
+        self.banned_edges = [False] * graph.number_of_edges()
+        self.banned_nodes = [False] * graph.number_of_nodes()
+
+    def search(self, spur_node, removed_edges, removed_nodes):
+        """ edge ids of the shortest spur_node - target path without
+        removed_edges and removed_nodes (None if there is no path) """
+        buffer, w, target = self.buffer, self.w, self.target
+        banned_edges, banned_nodes = self.banned_edges, self.banned_nodes
+        for e in removed_edges:
+            banned_edges[e] = True
+        for v in removed_nodes:
+            banned_nodes[v] = True
+        buffer.reset()
+        if self.negative:
+            tails, heads = buffer.tails, buffer.heads
+            masked_w = [float('inf') if banned_edges[e] or banned_nodes[tails[e]] or banned_nodes[heads[e]] else w[e]
+                        for e in range(len(w))]
+            BellmanFordCSR(buffer, spur_node, masked_w)
+        else:
+            MaskedDijkstra(buffer, spur_node, target, w, banned_edges, banned_nodes)
+        for e in removed_edges:
+            banned_edges[e] = False
+        for v in removed_nodes:
+            banned_nodes[v] = False
+        if buffer.distance[target] == float('inf'):
+            return None
+        return buffer.path(spur_node, target)
+
+
+# spur search of the worker process (set by init_spur_worker)
+spur_worker = None
+
+
+def init_spur_worker(graph, target, weight):
+    global spur_worker
+    spur_worker = SpurSearch(graph, target, weight)
+
+
+def solve_spur(task):
+    return spur_worker.search(*task)
+
+
+def YenKSPCSR(graph, source, target, weight, buffer=None, workers=1, prune=None, metrics=None):
+    """ generator k shortest (simple) path on the CSRGraph (lists of edge ids)
+    buffer: ShortestPathBuffer of graph (allocated if None)
+    workers: number of processes which solve the spur searches of an iteration
+             (the results are merged in the order of the spur nodes, so the
+             generated paths do not depend on workers)
+    prune: prune(v, c, t) is True if no path which reaches node v with the
+           sums c, t of graph.c, graph.t is needed, the spur searches from such
+           a root path are skipped (the paths are still generated in order,
+           so that the caller can stop on the length of the last one)
+    metrics: Metrics which counts the spur searches and the heap pushes and pops (optional) """
+    spur_search = SpurSearch(graph, target, weight, buffer)
+    heads, w = spur_search.buffer.heads, spur_search.w
+    if prune is not None:
+        c, t = graph.c.tolist(), graph.t.tolist()
+    executor = None
+    if workers > 1:
+        # the graph is passed once to each worker (inherited by the forked workers)
+        executor = ProcessPoolExecutor(workers, initializer=init_spur_worker, initargs=(graph, target, weight))
+
+    # Initialize the heap to store the potential kth shortest path
+    # and the set of the paths which are found (candidates and A)
+    A, B, found = [], [], set()
+    num_spur_searches = 0
+    try:
+        #  Determine the shortest path from the source to the sink.
+        path = spur_search.search(source, [], [])
+        if path is None:
+            return
+        yield path
+        A.append(path)
+        found.add(tuple(path))
+
+        while True:
+            path = A[-1]
+            path_nodes = [source] + [heads[e] for e in path]
+            # The spur node ranges from the first node to the next to last node in the previous (k+1)-shortest path.
+            # Spur node is retrieved from the previous k-shortest path, k - 1.
+            # Remove the links that are part of the previous shortest paths which share the same root path,
+            # and the root path nodes except the spur node.
+            spur_ids, tasks = [], []
+            root_c = root_t = 0.0
+            for i in range(len(path)):
+                if i > 0 and prune is not None:
+                    root_c, root_t = root_c + c[path[i-1]], root_t + t[path[i-1]]
+                if prune is not None and prune(path_nodes[i], root_c, root_t):
+                    continue
+                spur_ids.append(i)
+                tasks.append((path_nodes[i],
+                              [other[i] for other in A if len(other) > i and other[:i] == path[:i]],
+                              path_nodes[:i]))
+
+            # Calculate the spur path from the spur node to the sink.
+            num_spur_searches += len(tasks)
+            if executor is None or len(tasks) < 2:
+                spurs = [spur_search.search(*task) for task in tasks]
+            else:
+                spurs = list(executor.map(solve_spur, tasks))
+
+            for i, spur in zip(spur_ids, spurs):
+                if spur is not None:
+                    # Entire path is made up of the root path and spur path.
+                    total_path = tuple(path[:i] + spur)
+                    # Add the potential k-shortest path to the heap.
+                    if total_path not in found:
+                        found.add(total_path)
+                        heappush(B, (sum(w[e] for e in total_path), total_path))
+
+            if not B:
+                # This handles the case of there being no spur paths, or no spur paths left.
+                break
+            # Add the lowest cost path becomes the k-shortest path.
+            _, path = heappop(B)
+            A.append(list(path))
+            yield A[-1]
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if metrics is not None:
+            metrics.count('spur_searches', num_spur_searches)
+            metrics.count('ksp_heap_pushes', max(len(found)-1, 0))
+            metrics.count('ksp_heap_pops', max(len(A)-1, 0))
@@ -1,102 +1,296 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import networkx as nx
+import copy
+import functools
 import matplotlib.pyplot as plt
-from csv import reader as csv_reader
-from collections import defaultdict
+import numpy as np
+import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext, redirect_stdout
 from sys import argv
 
-from ShortestPath import shortest_path_bf
-from YenKSP import YenKSP
-from EppsteinKSP import EppsteinKSP
+from ShortestPath import ShortestPathBuffer, WarmStartShortestPath, shortest_path_csr
+from ShortestPath import Dijkstra, ReverseDijkstra, ReverseBellmanFordCSR
+from ParametricShortestPath import ParametricShortestPath
+from Potential import EuclideanPotential, LandmarkPotential
+from CSRGraph import CSRGraph
+from QueryCache import QueryCache
+from YenKSP import YenKSPCSR
+from EppsteinKSP import EppsteinPathGraph
+from LabelSetting import LabelSettingCSP
+from ContractionHierarchy import ContractionHierarchy
+from Metrics import Metrics
 
 
 __doc__ = f"""
 Usage:
-    {__file__} graph_file source target upper_bound [--print_path] [--yen]
+    {__file__} graph_file source target upper_bound [--print_path] [--yen] [--parametric] [--warm_start]
+        [--astar] [--landmarks num] [--bidirectional] [--no_cache] [--concurrent_steps] [--yen_workers num]
+        [--label_setting] [--auto_gap gap] [--quiet] [--metrics metrics_file]
+        [--time_limit sec] [--max_paths num] [--gap tolerance] [--ch]
+    {__file__} graph_file --batch query_file [--workers num] [options]
 
 Options:
     --print_path
     --yen        : Use Yen algorithm for the k shortest path problem
+    --yen_workers : Solve the spur paths of a Yen iteration on num processes
+                   (with --yen)
+    --label_setting : Use the label setting algorithm instead of the k shortest paths in Step4
+    --auto_gap   : Use the label setting algorithm in Step4 if the gap after Step3 is more than gap
+    --quiet      : Do not print the solver log (only the optimal solution)
+    --metrics    : Append the stage times and the counters of the solve to metrics_file
+                   (one JSON line per query)
+    --time_limit : Stop Step3 and Step4 after sec seconds with the best path found
+    --max_paths  : Stop Step4 after num k shortest paths (labels of the label setting algorithm)
+                   with the best path found
+    --gap        : Stop Step3 and Step4 when (UB-LB)/|UB| is at most tolerance
+                   (the stopped search prints the best path with LB and UB)
+    --parametric : Walk the breakpoints of L(u) in Step3 with one shortest path solve
+                   (default: two-point secant update of u)
+    --warm_start : Repair the shortest path tree of the previous Step3 iteration
+                   (without --parametric)
+    --astar      : Use A* search in Step1 - Step3 with the node positions of graph_file
+                   (landmark lower bounds if graph_file has no node section)
+    --landmarks  : Use A* search with num landmark lower bounds
+    --bidirectional : Use bidirectional Dijkstra in Step1 - Step3
+    --ch         : Solve the Step3 shortest paths on a customizable contraction hierarchy
+                   (built once per graph file, kept in graph_file.cch, and customized for each u,
+                   without --parametric)
+    --no_cache   : Do not read or write the binary graph file graph_file.csrg
+                   (and the contraction hierarchy file graph_file.cch)
+    --concurrent_steps : Solve Step2 in another process while Step1 is solved
+                         (only if t has negative weights, otherwise Step2 is read from
+                         the shortest path tree of Step0 and no process is started)
+    --batch      : Solve the queries of query_file on the graph loaded once,
+                   one result line source,target,upper_bound,f,g,path per query
+    --workers    : Solve the batch queries on num processes
+                   (the workers memory-map the binary graph file)
 
 Notes:
     Build Date: Mar 7 2019
     Main Algorithm            : Hander-Zang algorithm
     Shortest Path Algorithm   : Dijkstr algorithm
                               : Bellman-Ford algorithm
+                              : Parametric shortest path algorithm
+                              : Customizable contraction hierarchy
     K Shortest Path Algorithm : Eppstein algorithm
                               : Yen algorithm
+    Exact Algorithm (Step4)   : Label setting algorithm
 
 Graph (Multipul Directed Graph):
     format of graph_fileis 
     tail_node,head_node,weight(float),cost(float)
+    node positions (optional)
+    node x_position y_position
+    the graph is cached in graph_file.csrg (memory-mapped by later runs)
+    and the contraction hierarchy of --ch in graph_file.cch
+
+Query (--batch):
+    format of query_file is
+    source,target,upper_bound
 """
 
-PRINT_PATH = False
-YEN = False
+class SolverOptions:
+    """ options of the solver (the command line options) """
+
+    def __init__(self, print_path=False, yen=False, parametric=False, warm_start=False,
+                 astar=False, landmarks=0, bidirectional=False, cache=True, concurrent_steps=False,
+                 yen_workers=1, label_setting=False, auto_gap=None, verbose=True, metrics_file=None,
+                 time_limit=None, max_paths=None, gap=None, contraction_hierarchy=False):
+        self.print_path = print_path
+        self.yen = yen
+        self.parametric = parametric
+        self.warm_start = warm_start
+        self.astar = astar
+        self.landmarks = landmarks
+        self.bidirectional = bidirectional
+        self.cache = cache
+        self.concurrent_steps = concurrent_steps
+        self.yen_workers = yen_workers
+        self.label_setting = label_setting
+        self.auto_gap = auto_gap
+        self.verbose = verbose
+        self.metrics_file = metrics_file
+        self.time_limit = time_limit
+        self.max_paths = max_paths
+        self.gap = gap
+        self.contraction_hierarchy = contraction_hierarchy
+
+    @classmethod
+    def from_argv(cls, argv):
+        return cls(print_path='--print_path' in argv,
+                   yen='--yen' in argv,
+                   parametric='--parametric' in argv,
+                   warm_start='--warm_start' in argv,
+                   astar='--astar' in argv,
+                   landmarks=int(argv[argv.index('--landmarks')+1]) if '--landmarks' in argv else 0,
+                   bidirectional='--bidirectional' in argv,
+                   cache='--no_cache' not in argv,
+                   concurrent_steps='--concurrent_steps' in argv,
+                   yen_workers=int(argv[argv.index('--yen_workers')+1]) if '--yen_workers' in argv else 1,
+                   label_setting='--label_setting' in argv,
+                   auto_gap=float(argv[argv.index('--auto_gap')+1]) if '--auto_gap' in argv else None,
+                   verbose='--quiet' not in argv,
+                   metrics_file=argv[argv.index('--metrics')+1] if '--metrics' in argv else None,
+                   time_limit=float(argv[argv.index('--time_limit')+1]) if '--time_limit' in argv else None,
+                   max_paths=int(argv[argv.index('--max_paths')+1]) if '--max_paths' in argv else None,
+                   gap=float(argv[argv.index('--gap')+1]) if '--gap' in argv else None,
+                   contraction_hierarchy='--ch' in argv)
+
+    def use_label_setting(self, gap):
+        """ whether STEP4 is solved by the label setting algorithm (gap: gap after STEP3) """
+        return self.label_setting or (self.auto_gap is not None and gap > self.auto_gap)
+
+    def has_limit(self):
+        """ whether the search can be stopped by gap, time_limit or max_paths """
+        return self.gap is not None or self.time_limit is not None or self.max_paths is not None
+
+    def step_executor(self, graph):
+        """ executor of the STEP2 solve on graph (None if STEP1 and STEP2 are not concurrent)
+        graph and its buffers are kept in the worker process for all the queries
+        STEP2 is read from the tree to target of STEP0 if t is not negative, then it is not solved """
+        if not self.concurrent_steps or graph.t.size == 0 or graph.t.min() >= 0:
+            return None
+        return ProcessPoolExecutor(1, initializer=init_step_worker, initargs=(graph,))
 
 
 def usage():
     print(__doc__)
 
 
-def main(edge_file, source, target, upper_bound):
+def main(edge_file, source, target, upper_bound, options=None):
+    if options is None:
+        options = SolverOptions()
+    metrics = Metrics()
+    with open(os.devnull, 'w') as devnull, nullcontext() if options.verbose else redirect_stdout(devnull):
+        print_header(options)
+        graph = read_edge_file(edge_file, options.cache)
+        # the contraction hierarchy is kept in graph_file.cch for the later runs
+        hierarchy_builder = functools.partial(ContractionHierarchy.read, graph, edge_file) if options.cache else None
+        executor = options.step_executor(graph)
+        try:
+            opt_path, path_length, cost_length\
+                = dual_algorithm(graph, source, target, upper_bound, options, None, executor, metrics,
+                                 hierarchy_builder)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    if opt_path is not None:
+        print('\n\n')
+        if metrics.status == 'optimal':
+            print(f'*Optimal Solution: {path_length:.2f}')
+        else:
+            print(f'*Best Solution ({metrics.status}): {path_length:.2f}, LB = {metrics.LB:.2f}, UB = {metrics.UB:.2f}')
+        print(f'    path {opt_path}')
+        print(f'    f = {path_length:.3f}, g = {cost_length:.3f}')
+    if options.metrics_file is not None:
+        with open(options.metrics_file, 'a') as f:
+            metrics.write(f, source=source, target=target, upper_bound=upper_bound)
+
+
+def print_header(options):
     print('Build Date: Mar 07 2019')
     print('Main Algorithm            : Hander-Zang algorithm')
     print('Shortest Path Algorithm   : Dijkstra or Bellman-Ford algorithm')
-    if YEN:
+    if options.contraction_hierarchy:
+        print('Step3 Shortest Path       : Customizable contraction hierarchy')
+    if options.label_setting:
+        print('Exact Algorithm (Step4)   : Label setting algorithm')
+    elif options.yen:
         print('K Shortest Path Algorithm : Yen algorithm')
     else:
         print('K Shortest Path Algorithm : Eppstein algorithm')
     print()
 
-    G = read_edge_file(edge_file)
-    opt_path, path_length, cost_length\
-        = dual_algorithm(G, source, target, upper_bound)
 
-    if opt_path is not None:
-        print('\n\n')
-        print(f'*Optimal Solution: {path_length:.2f}')
-        print(f'    path {opt_path}')
-        print(f'    f = {path_length:.3f}, g = {cost_length:.3f}')
-
-
-def read_edge_file(edge_file):
+def read_query_file(query_file):
+    """ generator of the queries (source, target, upper_bound)
+    [query format]: source,target,upper_bound (or source target upper_bound)
+    blank lines and lines starting with # are skipped """
+    with open(query_file, 'r') as f:
+        for line in f:
+            row = line.strip()
+            if not row or row.startswith('#'):
+                continue
+            source, target, upper_bound = row.split(',') if ',' in row else row.split()
+            yield source.strip(), target.strip(), float(upper_bound)
+
+
+def solve_batch(graph, queries, options=None, cache=None, log=None):
+    """ generator of (query, (opt_path, path_length, cost_length), metrics) for each query
+    graph: CSRGraph, queries: iterable of (source, target, upper_bound)
+    options: SolverOptions
+    cache: QueryCache shared by the queries (allocated if None)
+    log: file object of the solver log of the queries (discarded if None) """
+    if cache is None:
+        cache = QueryCache(graph)
+    if log is None:
+        # the discarded log is not formatted
+        options = SolverOptions() if options is None else copy.copy(options)
+        options.verbose = False
+    executor = options.step_executor(graph) if options is not None else None
+    try:
+        with open(os.devnull, 'w') as devnull:
+            for source, target, upper_bound in queries:
+                # the log is redirected only while solving, not while the caller holds the result
+                metrics = Metrics()
+                with redirect_stdout(devnull if log is None else log):
+                    if source in graph.node_index and target in graph.node_index:
+                        result = dual_algorithm(graph, source, target, upper_bound, options, cache, executor, metrics)
+                    else:
+                        print(f'node {source} or {target} is not in the graph')
+                        result = None, None, None
+                yield (source, target, upper_bound), result, metrics
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def main_batch(edge_file, query_file, options=None, workers=1):
+    """ solve the queries of query_file on the graph of edge_file
+    (on workers processes if workers > 1)
+    one result line per query is written as soon as it is solved:
+    source,target,upper_bound,f,g,path nodes (f, g, path are empty if infeasible) """
+    if options is None:
+        options = SolverOptions()
+    queries = read_query_file(query_file)
+    if workers > 1:
+        from ParallelBatch import solve_batch_parallel
+        results = solve_batch_parallel(edge_file, queries, options, workers)
+    else:
+        graph = CSRGraph.read(edge_file, cache=options.cache)
+        cache = QueryCache(graph, edge_file=edge_file if options.cache else None)
+        results = solve_batch(graph, queries, options, cache)
+    metrics_file = None if options.metrics_file is None else open(options.metrics_file, 'a')
+    try:
+        print('source,target,upper_bound,f,g,path')
+        for (source, target, upper_bound), (opt_path, path_length, cost_length), metrics in results:
+            if opt_path is None:
+                print(f'{source},{target},{upper_bound},,,', flush=True)
+            else:
+                path_nodes = ' '.join(str(node) for node in [source] + [head for _, head, _ in opt_path])
+                print(f'{source},{target},{upper_bound},{path_length:.6f},{cost_length:.6f},{path_nodes}', flush=True)
+            if metrics_file is not None:
+                metrics.write(metrics_file, source=source, target=target, upper_bound=upper_bound)
+    finally:
+        if metrics_file is not None:
+            metrics_file.close()
+
+
+def read_edge_file(edge_file, cache=True):
     # read graph node - edge data
     # [node format]:  node, x position, y position
     # [edge format]: head node, tail node, objective cost, constraint cost
 
-    G = nx.MultiDiGraph()
-    edge_dict = defaultdict(list)
+    graph = CSRGraph.read(edge_file, cache=cache)
 
-    with open(edge_file, 'r') as f:
-        for row in csv_reader(f):
-            if len(row) == 4:
-                tail, head, weight, cost = row
-                weight = float(weight)
-                cost = float(cost)
-                edge_dict[tail, head].append((weight, cost))
+    print(f'the number of nodes: {graph.number_of_nodes()}')
+    print(f'the number of edges: {graph.number_of_edges()}')
 
-    for (tail, head), edges in edge_dict.items():
-        for key, (weight, cost) in enumerate(edges):
-            G.add_edge(tail, head, c=weight, t=cost, key=key)
-
-    print(f'the number of nodes: {G.number_of_nodes()}')
-    print(f'the number of edges: {G.number_of_edges()}')
-
-    return G
-
-
-def convert_graph_weight(G, u):
-    H = nx.MultiDiGraph()
-    for tail in G:
-        for head, edges in G[tail].items():
-            for key, weights in edges.items():
-                c, t = weights['c'], weights['t']
-                H.add_edge(tail, head, w=c+u*t, c=c, t=t, key=key)
-    return H
+    return graph
 
 
 def print_log_head():
@@ -112,152 +306,527 @@ def print_log(step, update, iter_count, gap=None, LB=None, UB=None, time=None):
     print(f'{iter_count:5d} {step:>4s} {update:>6s} {UB} {LB} {UB} {gap}% {time:6.0f}s')
 
 
+def relative_gap(LB, UB):
+    """ (UB-LB)/|UB|, the gap compared with the options gap and auto_gap """
+    if LB >= UB:
+        return 0.0
+    if UB == 0 or not np.isfinite(UB):
+        return np.inf
+    return (UB - LB) / abs(UB)
+
+
 def print_best_sol(best_path, path_length, cost_length):
     print(f'*Best Solution: {path_length:.2f}')
     print(f'    path {best_path}')
     print(f'    f = {path_length:.3f}, g = {cost_length:.3f}')
 
 
-def dual_algorithm(G, source, target, upper_bound):
+def shared_shortest_path(graph, source, target, key, cache, edges=None):
+    """ Step1 (key='c') or Step2 (key='t') path from the tree to target in cache
+    edges: edge ids of graph of the Step0 subgraph (sorted), the path of the tree
+           is not shared if it leaves them (the tree is on all the edges of graph)
+    return path_edges, f, g (None if there is no shared tree) """
+    if cache is None:
+        return None, None, None
+    path = cache.shortest_path(graph.node_index[source], graph.node_index[target], key)
+    if path is None:
+        return None, None, None
+    if edges is not None and not np.isin(path, edges, assume_unique=True).all():
+        return None, None, None
+    return graph.path_edges(path), graph.c[path].sum(), graph.t[path].sum()
+
+
+def distance_to_target(buffer, target, weight):
+    """ shortest distance to target of every node on weight (list) """
+    buffer.reset()
+    if weight.size == 0 or weight.min() >= 0:
+        ReverseDijkstra(buffer, target, weight.tolist())
+    else:
+        ReverseBellmanFordCSR(buffer, target, weight.tolist())
+    distance = list(buffer.distance)
+    buffer.reset()
+    return distance
+
+
+def t_distances(graph, source, target, cache=None):
+    """ shortest distance on t (non-negative) from source and to target of every node
+    and the successor edge of every node in the shortest path tree to target """
+    if cache is not None:
+        to_target, successor = cache.tree(target, 't')
+        return cache.tree(source, 't', reverse=False)[0], to_target, successor
+    buffer = ShortestPathBuffer(graph)
+    t = graph.t.tolist()
+    Dijkstra(buffer, source, -1, t)
+    from_source = np.array(buffer.distance)
+    buffer.reset()
+    ReverseDijkstra(buffer, target, t)
+    return from_source, np.array(buffer.distance), np.array(buffer.predecessor, dtype=np.int64)
+
+
+def tree_shortest_path(graph, source, target, successor):
+    """ path_edges, f, g of the source - target path on the successor edges of a tree to target """
+    path = []
+    v = source
+    while v != target:
+        e = int(successor[v])
+        path.append(e)
+        v = graph.heads[e]
+    return graph.path_edges(path), graph.c[path].sum(), graph.t[path].sum()
+
+
+def no_log(*args, **kwargs):
+    pass
+
+
+def step0(graph, source, target, upper_bound, cache=None):
+    """ STEP0 (shrink source - target path) on the node ids source and target
+    return subgraph, t_successor, t_min
+        subgraph: the nodes and edges of the source - target paths whose t is at most upper_bound
+                  (of all the source - target paths if t has negative weights),
+                  None if there is no such path
+        t_successor: successor edges of the shortest path tree to target on t (None if t is negative)
+        t_min: minimum t of the source - target paths (inf if there is no path, None if t is negative) """
+    if graph.t.size == 0 or graph.t.min() >= 0:
+        # keep the nodes and edges of the paths whose t is at most upper_bound
+        t_from_source, t_to_target, t_successor = t_distances(graph, source, target, cache)
+        t_min = t_from_source[target]
+        if t_min > upper_bound:
+            return None, t_successor, t_min
+        tolerance = 1e-9 * (1 + abs(upper_bound))
+        node_mask = t_from_source + t_to_target <= upper_bound + tolerance
+        edge_mask = t_from_source[graph.tails] + graph.t + t_to_target[graph.heads] <= upper_bound + tolerance
+    else:
+        reachable = graph.reachable if cache is None else cache.reachable
+        node_mask = reachable(source)
+        if not node_mask[target]:
+            return None, None, np.inf
+        node_mask = node_mask & reachable(target, reverse=True)
+        edge_mask = t_successor = t_min = None
+    return graph.subgraph(node_mask, edge_mask), t_successor, t_min
+
+
+def step3_secant(graph, upper_bound, shortest_path, plus, minus, LB, UB, options, limit=None, log=no_log,
+                 metrics=None):
+    """ STEP3 (two-point secant update of the lagrangian multiplier u)
+    shortest_path: function of (w, u) to the edge ids of the shortest path on w = c + u*t
+    plus: f, g - upper_bound of the infeasible path of STEP1
+    minus: path_edges, f, g - upper_bound of the feasible path of STEP2 (the best path)
+    limit: function of (LB, UB) which returns a status to stop the search (None to go on)
+    log: function of (update, LB, UB) called at every iteration
+    return status of limit (None if it did not stop), u, LB, UB, minus (the best path)
+    (LB equals UB if the best path is optimal) """
+    epsilon = 0.000001 # the terminating parametor of Step3
+    path_plus, cost_plus = plus
+    opt_minus, path_minus, cost_minus = minus
+    u = (path_minus - path_plus) / (cost_plus - cost_minus)
+    L = path_plus + u * cost_plus
+    while True:
+        update = ""
+        w = graph.weight(u)
+        if metrics is not None:
+            metrics.count('step3_iterations')
+        path = shortest_path(w, u)
+        path_edges = graph.path_edges(path)
+        Lu = w[path].sum() - u * upper_bound
+        path_length = graph.c[path].sum()
+        cost_length = graph.t[path].sum() - upper_bound
+        if cost_length == 0:
+            # find opt sol
+            return None, u, path_length, path_length, (path_edges, path_length, cost_length)
+        elif abs(Lu - L) < epsilon and cost_length < 0:
+            if LB < Lu:
+                update += " LB"
+                LB = Lu
+            if path_length < UB:
+                # the best path, its f and g are replaced together
+                update += " UB"
+                opt_minus  = path_edges
+                path_minus = path_length
+                cost_minus = cost_length
+                UB = path_length
+                if options.verbose and options.print_path:
+                    print_best_sol(path_edges, path_length, cost_length+upper_bound)
+            log(update, LB, UB)
+            break
+        elif abs(Lu - L) < epsilon and cost_length > 0:
+            if LB < Lu:
+                update += " LB"
+            if path_minus < UB:
+                update += " UB"
+            LB = Lu
+            UB = path_minus
+            log(update, LB, UB)
+            break
+        elif cost_length > 0:
+            path_plus = path_length
+            cost_plus = cost_length
+        elif cost_length <= 0:
+            opt_minus  = path_edges
+            path_minus = path_length
+            cost_minus = cost_length
+            if path_length < UB:
+                update += " UB"
+                UB = path_length
+                if options.verbose and options.print_path:
+                    print_best_sol(path_edges, path_length, cost_length+upper_bound)
+        u = (path_minus - path_plus) / (cost_plus - cost_minus)
+        L = path_plus + u * cost_plus
+        log(update, LB, UB)
+        status = None if limit is None else limit(LB, UB)
+        if status is not None:
+            return status, u, LB, UB, (opt_minus, path_minus, cost_minus)
+    return None, u, LB, UB, (opt_minus, path_minus, cost_minus)
+
+
+# graph and buffer of the STEP2 worker process (set by init_step_worker)
+step_graph = None
+step_buffer = None
+
+
+def init_step_worker(graph):
+    global step_graph, step_buffer
+    step_graph = graph
+    step_buffer = ShortestPathBuffer(graph)
+
+
+def solve_step2(source, target, bidirectional):
+    """ edge ids of the shortest source - target path on t in the worker graph
+    (on the edges of the source - target paths, as the STEP0 subgraph) """
+    graph = step_graph
+    node_mask = graph.reachable(source) & graph.reachable(target, reverse=True)
+    t = np.where(node_mask[graph.tails] & node_mask[graph.heads], graph.t, np.inf)
+    return shortest_path_csr(graph, source, target, t, step_buffer, None, bidirectional)
+
+
+def dual_algorithm(graph, source, target, upper_bound, options=None, cache=None, executor=None, metrics=None,
+                   hierarchy_builder=None):
+    """graph: CSRGraph
+    options: SolverOptions (default options if None)
+    cache: QueryCache of graph shared by the queries (optional)
+    executor: options.step_executor(graph) which solves STEP2 concurrently with STEP1 (optional)
+    metrics: Metrics of the stage times and the counters of the solve (optional)
+    hierarchy_builder: function returning the ContractionHierarchy of graph for options.contraction_hierarchy,
+                       called only if STEP3 needs it (the one of cache, or built on graph, if None)
+    the path is optimal unless metrics.status is a limit of options (the best path found then)"""
+    if options is None:
+        options = SolverOptions()
+    if metrics is None:
+        metrics = Metrics()
+    try:
+        result = dual_algorithm_steps(graph, source, target, upper_bound, options, cache, executor, metrics,
+                                      hierarchy_builder)
+        if metrics.status is None:
+            metrics.status = 'infeasible' if result[0] is None else 'optimal'
+            metrics.LB = metrics.UB = None if result[0] is None else float(result[1])
+        return result
+    finally:
+        metrics.stop()
+
+
+def dual_algorithm_steps(graph, source, target, upper_bound, options, cache, executor, metrics, hierarchy_builder):
     iter_count = 0
     start_time = time.time()
+    # the messages and the iteration log are skipped (not formatted) if not options.verbose
+    say = print if options.verbose else no_log
+    log_head, log = (print_log_head, print_log) if options.verbose else (no_log, no_log)
+
+    def limit(LB, UB, num_paths=0):
+        """ the limit of options which stops the search (None if it goes on) """
+        if options.gap is not None and relative_gap(LB, UB) <= options.gap:
+            return 'gap'
+        if options.time_limit is not None and time.time() - start_time >= options.time_limit:
+            return 'time_limit'
+        if options.max_paths is not None and num_paths >= options.max_paths:
+            return 'path_limit'
+        return None
+
+    def stop(status):
+        """ the best path found with the bounds in metrics """
+        metrics.status, metrics.LB, metrics.UB = status, float(min(LB, UB)), float(UB)
+        return opt_minus, path_minus, cost_minus+upper_bound
 
     # STEP0 (shrink source - target path)
-    reachable_nodes_from_source = set()
-    for edge in nx.bfs_edges(G, source=source):
-        tail, head = edge
-        reachable_nodes_from_source |= {tail, head}
-    if target not in reachable_nodes_from_source:
-        print('There does not exist source {source} - target {target} path')
+    metrics.start('step0')
+    source_id, target_id = graph.node_index[source], graph.node_index[target]
+    # the tree to target on t is kept for STEP2
+    full_graph, full_source_id, full_target_id = graph, source_id, target_id
+    graph, t_successor, t_min = step0(full_graph, source_id, target_id, upper_bound, cache)
+    if graph is None:
+        if t_min == np.inf:
+            say(f'There does not exist source {source} - target {target} path')
+        else:
+            say('We find there is not a path satisfies the constrainet')
+            say(f'the minimum cost path length is {t_min}')
         return None, None, None
-    reachable_nodes_to_target = set()
-    for edge in nx.bfs_edges(G.reverse(), source=target):
-        tail, head = edge
-        reachable_nodes_to_target |= {tail, head}
-    G = G.subgraph(reachable_nodes_from_source & reachable_nodes_to_target)
-    
-    print('\nRemove the nodes which does not contained source - target path (#STEP0)')
-    print(f'remained the number of nodes: {G.number_of_nodes()}')
-    print(f'remained number of edges: {G.number_of_edges()}\n')
+
+    say('\nRemove the nodes which does not contained source - target path (#STEP0)')
+    say(f'remained the number of nodes: {graph.number_of_nodes()}')
+    say(f'remained number of edges: {graph.number_of_edges()}\n')
+
+    source_id, target_id = graph.node_index[source], graph.node_index[target]
+    # distance and predecessor buffers shared by all shortest path solves
+    buffer = ShortestPathBuffer(graph)
+
+    # lower bounds of the distance to target for the A* search
+    # (the landmarks of the cache are on the full graph, they are indexed by the subgraph nodes)
+    lower_bound, bound_target, bound_nodes = None, target_id, None
+    if options.landmarks or (options.astar and not graph.has_positions()):
+        if cache is None:
+            lower_bound = LandmarkPotential(graph, options.landmarks or 4)
+        else:
+            lower_bound = cache.landmark_potential(options.landmarks or 4)
+            bound_target, bound_nodes = full_target_id, graph.parent_nodes
+    elif options.astar:
+        lower_bound = EuclideanPotential(graph)
+
+    def potential(alpha, beta):
+        if lower_bound is None:
+            return None
+        return lower_bound.potential(bound_target, alpha, beta, bound_nodes)
+
+    def count_solve():
+        metrics.count('shortest_path_solves')
+        metrics.count('settled_nodes', buffer.num_settled)
+
+    def step_path(key, alpha, beta, future=None):
+        """ path_edges, f, g of the shortest path on key
+        (from the shared tree, from future, or solved here) """
+        if future is None:
+            if key == 't' and t_successor is not None:
+                return tree_shortest_path(full_graph, full_source_id, full_target_id, t_successor)
+            path_edges, path_length, cost_length = shared_shortest_path(full_graph, source, target, key, cache,
+                                                                        graph.parent_edges)
+            if path_edges is not None:
+                return path_edges, path_length, cost_length
+            path = shortest_path_csr(graph, source_id, target_id, getattr(graph, key), buffer,
+                                     potential(alpha, beta), options.bidirectional)
+            count_solve()
+        else:
+            # edge ids of the full graph
+            path = future.result()
+            metrics.count('shortest_path_solves')
+            return full_graph.path_edges(path), full_graph.c[path].sum(), full_graph.t[path].sum()
+        return graph.path_edges(path), graph.c[path].sum(), graph.t[path].sum()
+
+    # STEP2 is solved by the executor while STEP1 is solved here
+    # (if the tree to target of STEP0 does not give it)
+    step2 = None
+    if executor is not None and t_successor is None:
+        step2 = executor.submit(solve_step2, full_source_id, full_target_id, options.bidirectional)
 
     # STEP1 (obtain shortest pash respect to "weight")
-    _, path_edges = shortest_path_bf(G, source, target, weight='c')
-    path_length = sum(G[tail][head][key]['c'] for tail, head, key in path_edges)
-    cost_length = sum(G[tail][head][key]['t'] for tail, head, key in path_edges) - upper_bound
+    metrics.start('step1')
+    path_edges, path_length, cost_length = step_path('c', 1, 0)
+    cost_length -= upper_bound
 
     if cost_length <= 0:
+        if step2 is not None:
+            step2.cancel()
         opt_path = path_edges
         return opt_path, path_length, cost_length+upper_bound
     else:
         path_plus = path_length
         cost_plus = cost_length
         LB        = path_length
-        print('We obtain shortest path on weight (#STEP1)')
-        if PRINT_PATH: print(f'    path {path_edges}')
-        print(f'    f = {path_length:.3f}, g = {cost_length+upper_bound:.3f}\n')
+        say('We obtain shortest path on weight (#STEP1)')
+        if options.print_path: say(f'    path {path_edges}')
+        say(f'    f = {path_length:.3f}, g = {cost_length+upper_bound:.3f}\n')
 
     # STEP2(obtain shortest path respect to "cost")
-    _, path_edges = shortest_path_bf(G, source=source, target=target, weight='t')
-    path_length = sum(G[tail][head][key]['c'] for tail, head, key in path_edges)
-    cost_length = sum(G[tail][head][key]['t'] for tail, head, key in path_edges) - upper_bound
+    metrics.start('step2')
+    path_edges, path_length, cost_length = step_path('t', 0, 1, step2)
+    cost_length -= upper_bound
 
     if cost_length > 0:
-        print(f'We find there is not a path satisfies the constrainet')
-        print(f'the minimum cost path length is {cost_length+upper_bound}')
+        say(f'We find there is not a path satisfies the constrainet')
+        say(f'the minimum cost path length is {cost_length+upper_bound}')
         return None, None, None
     else:
         opt_minus  = path_edges
         path_minus = path_length
         cost_minus = cost_length
         UB         = path_length
-        print('We obtain shortest path on cost (#STEP2)')
-        if PRINT_PATH: print(f'    path {path_edges}')
-        print(f'    f = {path_length:.3f}, g = {cost_length+upper_bound:.3f}\n')
+        say('We obtain shortest path on cost (#STEP2)')
+        if options.print_path: say(f'    path {path_edges}')
+        say(f'    f = {path_length:.3f}, g = {cost_length+upper_bound:.3f}\n')
 
-    print(f'Best Solution: {path_minus: .3f}\n')
+    say(f'Best Solution: {path_minus: .3f}\n')
     u = (path_minus - path_plus) / (cost_plus - cost_minus)
-    L = path_plus + u * cost_plus
 
 
     iter_count += 1
-    print_log_head()
-    print_log(step='#1', update='LB', iter_count=iter_count, LB=LB, time=time.time()-start_time)
+    log_head()
+    log(step='#1', update='LB', iter_count=iter_count, LB=LB, time=time.time()-start_time)
     iter_count += 1
-    print_log(step='#2', update='UB', iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
+    log(step='#2', update='UB', iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
 
 
     # STEP3
-    epsilon = 0.000001 # the terminating parametor of Step3
-    while True:
+    metrics.start('step3')
+    if options.parametric and graph.c.min() >= 0 and graph.t.min() >= 0:
+        # walk the breakpoints of L(u) to the dual optimum
         iter_count += 1
-        if iter_count % 20 == 0:
-            print_log_head()
-        update = ""
-        H = convert_graph_weight(G, u)
-        _, path_edges = shortest_path_bf(H, source, target, weight='w')
-        Lu = sum(H[tail][head][key]['w'] for tail, head, key in path_edges) - u * upper_bound
-        path_length = sum(G[tail][head][key]['c'] for tail, head, key in path_edges)
-        cost_length = sum(G[tail][head][key]['t'] for tail, head, key in path_edges) - upper_bound
+        parametric = ParametricShortestPath(graph, source_id, target_id, buffer)
+
+        def piece_limit(u, path):
+            """ the bounds of the piece of L(u) with path, and the limit of options """
+            nonlocal LB, UB, opt_minus, path_minus, cost_minus
+            path_length = graph.c[path].sum()
+            cost_length = graph.t[path].sum() - upper_bound
+            LB = max(LB, path_length + u * cost_length)
+            if cost_length <= 0 and path_length < UB:
+                opt_minus, path_minus, cost_minus = graph.path_edges(path), path_length, cost_length
+                UB = path_length
+            return limit(LB, UB)
+
+        u, _, path = parametric.search(u, upper_bound, limit=piece_limit)
+        metrics.count('step3_iterations')
+        metrics.count('shortest_path_solves', parametric.num_solves)
+        if parametric.status is not None:
+            log(step='#3', update='', iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
+            return stop(parametric.status)
+        path_edges = graph.path_edges(path)
+        path_length = graph.c[path].sum()
+        cost_length = graph.t[path].sum() - upper_bound
         if cost_length == 0:
             return path_edges, path_length, cost_length+upper_bound # find opt sol
-        elif abs(Lu - L) < epsilon and cost_length < 0:
-            opt_minus = path_edges
-            if LB < Lu:
-                update += " LB"
-                LB = Lu
-            if path_length < UB:
-                update += " UB"
-                UB = path_length
-                if PRINT_PATH:
-                    print_best_sol(path_edges, path_length, cost_length+upper_bound)
-            print_log(step='#3', update=update, iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
-            break
-        elif abs(Lu - L) < epsilon and cost_length > 0:
-            if LB < Lu:
-                update += " LB"
-            if path_minus < UB:
-                update += " UB"
+        update = ""
+        Lu = path_length + u * cost_length
+        if LB < Lu:
+            update += " LB"
             LB = Lu
-            UB = path_minus
-            print_log(step='#3', update=update, iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
-            break
-        elif cost_length > 0:
-            path_plus = path_length
-            cost_plus = cost_length
-        elif cost_length <= 0:
+        if path_length < UB:
+            update += " UB"
             opt_minus  = path_edges
             path_minus = path_length
             cost_minus = cost_length
-            if path_length < UB:
-                update += " UB"
-                UB = path_length
-                if PRINT_PATH:
-                    print_best_sol(path_edges, path_length, cost_length+upper_bound)
-        u = (path_minus - path_plus) / (cost_plus - cost_minus)
-        L = path_plus + u * cost_plus
-        print_log(step='#3', update=update, iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
+            UB = path_length
+            if options.verbose and options.print_path:
+                print_best_sol(path_edges, path_length, cost_length+upper_bound)
+        log(step='#3', update=update, iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
+        say(f'{"":>5s} {parametric.num_pieces} pieces of L(u) ({parametric.num_breakpoints} breakpoints) passed'
+            f' with {parametric.num_solves} shortest path solve')
+    else:
+        hierarchy = None
+        if options.contraction_hierarchy and graph.c.min() >= 0 and graph.t.min() >= 0:
+            # customized on the edges of graph (the triangles of the other edges of full_graph are dropped)
+            metrics.start('contraction')
+            try:
+                if cache is not None:
+                    hierarchy = cache.contraction_hierarchy()
+                elif hierarchy_builder is not None:
+                    hierarchy = hierarchy_builder()
+                else:
+                    hierarchy = ContractionHierarchy(full_graph)
+                hierarchy = hierarchy.restrict(graph.parent_edges)
+            except ValueError as e:
+                say(f'{"":>5s} {e}, Step3 is solved without it')
+            metrics.start('step3')
+        if hierarchy is None and options.warm_start:
+            warm_start = WarmStartShortestPath(graph, source_id, buffer)
+
+        def shortest_path(w, u):
+            if hierarchy is not None:
+                hierarchy.customize(w)
+                path = hierarchy.path(full_source_id, full_target_id)
+                metrics.count('shortest_path_solves')
+                metrics.count('settled_nodes', hierarchy.num_settled)
+            elif options.warm_start:
+                warm_start.solve(w)
+                path = warm_start.path(target_id)
+                metrics.count('shortest_path_solves')
+                metrics.count('settled_nodes', warm_start.num_settled)
+            else:
+                path = shortest_path_csr(graph, source_id, target_id, w, buffer,
+                                         potential(1, u), options.bidirectional)
+                count_solve()
+            return path
+
+        def step3_log(update, LB, UB):
+            nonlocal iter_count
+            iter_count += 1
+            if iter_count % 20 == 0:
+                log_head()
+            log(step='#3', update=update, iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
+
+        status, u, LB, UB, (opt_minus, path_minus, cost_minus) = step3_secant(
+            graph, upper_bound, shortest_path, (path_plus, cost_plus), (opt_minus, path_minus, cost_minus),
+            LB, UB, options, limit, step3_log, metrics)
+        if status is not None:
+            return stop(status)
 
     if LB >= UB:
         return opt_minus, path_minus, cost_minus+upper_bound # find opt sol
+    status = limit(LB, UB)
+    if status is not None:
+        return stop(status)
 
     # STEP 4   CLOSING THE GAP
-    H = convert_graph_weight(G, u)
-    if YEN:
-        k_shortest_paths = YenKSP(H, source, target, 'w')
+    metrics.start('step4')
+    # the deviations whose prefix can not be completed to a feasible path
+    # shorter than UB are not searched (lower bounds of c and t to target)
+    c_to_target = distance_to_target(buffer, target_id, graph.c)
+    t_to_target = distance_to_target(buffer, target_id, graph.t)
+    metrics.count('shortest_path_solves', 2)
+    tolerance = 1e-9 * (1 + abs(upper_bound))
+
+    def prune(v, c, t):
+        return t + t_to_target[v] > upper_bound + tolerance or c + c_to_target[v] >= UB + tolerance
+
+    if options.use_label_setting(relative_gap(LB, UB)):
+        # the shortest feasible path shorter than UB (None if UB is optimal)
+        iter_count += 1
+        update = ""
+        metrics.count('step4_iterations')
+
+        def label_limit(key, num_labels):
+            """ the limit of options with the lower bound of the popped label (num_labels for max_paths) """
+            nonlocal LB
+            LB = max(LB, min(key, UB))
+            return limit(LB, UB, num_labels)
+
+        # (the limit is checked for every popped label only if options have one)
+        path, status = LabelSettingCSP(graph, source_id, target_id, upper_bound, c_to_target, t_to_target, UB,
+                                       metrics, label_limit if options.has_limit() else None)
+        if path is not None:
+            opt_minus = graph.path_edges(path)
+            path_minus = graph.c[path].sum()
+            cost_minus = graph.t[path].sum() - upper_bound
+            UB = path_minus
+            update += " UB"
+            if options.verbose and options.print_path:
+                print_best_sol(opt_minus, path_minus, cost_minus+upper_bound)
+        if status is not None:
+            log(step='#4', update=update, iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
+            return stop(status)
+        update += " LB"
+        LB = UB
+        log(step='#4', update=update, iter_count=iter_count, gap=0, LB=LB, UB=UB, time=time.time()-start_time)
+        return opt_minus, path_minus, cost_minus+upper_bound # find opt sol
+
+    w = graph.weight(u)
+    if options.yen:
+        k_shortest_paths = YenKSPCSR(graph, source_id, target_id, w, buffer, options.yen_workers, prune, metrics)
     else:
-        k_shortest_paths = EppsteinKSP(H, source, target, 'w')
-    k_shortest_paths.__next__()
-    k_shortest_paths.__next__()
+        k_shortest_paths = EppsteinPathGraph(graph, target_id, w).paths(source_id, prune=prune, metrics=metrics)
+    # the first two paths are the ones of STEP3, the best path is optimal if there is no other path
+    for _ in range(2):
+        if next(k_shortest_paths, None) is None:
+            k_shortest_paths.close()
+            return opt_minus, path_minus, cost_minus+upper_bound # find opt sol
+        metrics.count('ksp_paths')
     while True:
         iter_count += 1
+        metrics.count('step4_iterations')
         if iter_count % 20 == 0:
-            print_log_head()
+            log_head()
         update = ""
         try:
-            _, path_edges = k_shortest_paths.__next__()
-            Lu = sum(H[tail][head][key]['w'] for tail, head, key in path_edges) - u * upper_bound
-            path_length = sum(G[tail][head][key]['c'] for tail, head, key in path_edges)
-            cost_length = sum(G[tail][head][key]['t'] for tail, head, key in path_edges) - upper_bound
+            path = k_shortest_paths.__next__()
+            metrics.count('ksp_paths')
+            Lu = w[path].sum() - u * upper_bound
+            path_length = graph.c[path].sum()
+            cost_length = graph.t[path].sum() - upper_bound
         except StopIteration:
             Lu = path_length = float('inf')
         if LB < Lu:
@@ -265,23 +834,29 @@ def dual_algorithm(G, source, target, upper_bound):
         LB = Lu
         if cost_length <= 0 and path_length < UB:
             UB = path_length
-            opt_minus = path_edges
+            opt_minus = graph.path_edges(path)
             path_minus = path_length
             cost_minus = cost_length
             update += " UB"
-            if PRINT_PATH:
-                print_best_sol(path_edges, path_length, cost_length+upper_bound)
-        print_log(step='#4', update=update, iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
+            if options.verbose and options.print_path:
+                print_best_sol(opt_minus, path_length, cost_length+upper_bound)
+        log(step='#4', update=update, iter_count=iter_count, gap=(UB-LB)/(abs(UB)-1), LB=LB, UB=UB, time=time.time()-start_time)
         if LB >= UB:
+            k_shortest_paths.close() # shut down the spur path workers
             return opt_minus, path_minus, cost_minus+upper_bound # find opt sol
+        status = limit(LB, UB, metrics.counts['ksp_paths'])
+        if status is not None:
+            k_shortest_paths.close()
+            return stop(status)
 
 
 if __name__ == '__main__':
-    if len(argv) > 4:
-        if '--print_path' in argv:
-            PRINT_PATH = True
-        if '--yen' in argv:
-            YEN = True
-        main(*argv[1:4], float(argv[4]))
+    if len(argv) > 4 or (len(argv) > 3 and argv[2] == '--batch'):
+        options = SolverOptions.from_argv(argv)
+        if argv[2] == '--batch':
+            workers = int(argv[argv.index('--workers')+1]) if '--workers' in argv else 1
+            main_batch(argv[1], argv[3], options, workers)
+        else:
+            main(*argv[1:4], float(argv[4]), options)
     else:
         usage()
@@ -6,6 +6,9 @@ from collections import deque, defaultdict
 from math import log2, floor, log
 
 class Node:
+    # __dict__ を持たない (ノードは辺の数だけ作られるため)
+    __slots__ = ('name', 'value', 'parent', 'ix', 'left', 'right', 'h_out')
+
     def __init__(self, name, delta, parent, ix):
         self.name   = name
         self.value  = delta
@@ -35,15 +38,26 @@ class BinaryTree:
     def __init__(self):
         self.root = None
         self.num  = 0 # データ個数
+        self.index = dict() # name -> node
+        self.base = None    # persistent_insert の元の木 (index にない名前はこちらを探す)
 
     # 探索
-    def search(self, x):
-        return node.search(self.root, x)
+    def search(self, name):
+        """ node of name (None if name is not in the tree)
+        for a tree of persistent_insert, the names of the copied nodes are
+        looked up first and the other names in the trees it is made from """
+        tree = self
+        while tree is not None:
+            if name in tree.index:
+                return tree.index[name]
+            tree = tree.base
+        return None
 
     # 挿入
     def insert(self, name, delta):
         if self.root is None:
             self.root = Node(name, delta, None, 0)
+            self.index[name] = self.root
         else:
             node_ix = self.num
             dircs = []
@@ -63,6 +77,8 @@ class BinaryTree:
             else:
                 curr_node.right = Node(name, delta, curr_node, self.num)
                 curr_node = curr_node.right
+            # 持ち上げではノードごと付け替えるので index はそのまま
+            self.index[name] = curr_node
 
             # 上に持ち上げ
             for dirc in dircs[::-1]:
@@ -107,8 +123,50 @@ class BinaryTree:
                 parent.ix, curr_node.ix = curr_node.ix, parent.ix
         self.num = self.num + 1
 
+    # 永続的な挿入 (挿入位置までの経路だけをコピー)
+    def persistent_insert(self, name, delta):
+        """ return a new tree with (name, delta) inserted, self is not changed
+        only the nodes on the path from the root to the new position are copied
+        (with their h_out) and the other subtrees are shared with self,
+        the parents of the shared nodes are not updated, so the new tree must be
+        extended by persistent_insert (not by insert) """
+        node_ix = self.num
+        dircs = []
+        while node_ix > 0:
+            dircs.append(node_ix%2) # 0 -> right, 1 -> left
+            node_ix = (node_ix-1) // 2
+
+        tree = BinaryTree()
+        tree.num = self.num + 1
+        tree.base = self
+        # 根から順に, 値の小さい方を残して大きい方を下に運ぶ
+        carry = (name, delta, None) # (name, value, h_out)
+        curr_node, parent, ix = self.root, None, 0
+        for dirc in dircs[::-1] + [None]:
+            if curr_node is None:
+                node = Node(carry[0], carry[1], parent, ix)
+                node.h_out = carry[2]
+            else:
+                node = Node(curr_node.name, curr_node.value, parent, ix)
+                node.left, node.right, node.h_out = curr_node.left, curr_node.right, curr_node.h_out
+                if carry[1] < node.value:
+                    carry, (node.name, node.value, node.h_out) = (node.name, node.value, node.h_out), carry
+            tree.index[node.name] = node
+            if parent is None:
+                tree.root = node
+            elif ix % 2:
+                parent.left = node
+            else:
+                parent.right = node
+            if dirc is None:
+                break
+            parent, ix = node, 2*ix+1 if dirc else 2*ix+2
+            curr_node = curr_node.left if dirc else curr_node.right
+        return tree
+
     def root_insert(self, name, delta):
         root_node = Node(name, delta, None, 0)
+        self.index[name] = root_node
         if self.root is not None:
             root_node.left = self.root
             self.root.parent = root_node
@@ -118,9 +176,9 @@ class BinaryTree:
     def h_out_insert(self, other_tree):
         if self.root is None or other_tree.root is None:
             return
-        for node in self.traverse():
-            if node.name == other_tree.root.name:
-                break
+        node = self.search(other_tree.root.name)
+        if node is None:
+            return
         node.h_out = other_tree.root.left
         if other_tree.root.left is not None:
             other_tree.root.left.parent = node
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import functools
+import random
+
+import networkx as nx
+import pytest
+
+from CSRGraph import CSRGraph
+from ContractionHierarchy import ContractionHierarchy
+from Metrics import Metrics
+from QueryCache import QueryCache
+from dual_algorithm import SolverOptions, dual_algorithm, solve_batch
+
+
+def random_graph(seed, num_nodes=8, max_weight=None):
+    """ MultiDiGraph with the integer c and the t of two decimals of graph_data
+    (c and t are integers up to max_weight if given, then many paths tie on L(u)) """
+    rnd = random.Random(seed)
+    G = nx.MultiDiGraph()
+    G.add_nodes_from(range(num_nodes))
+    for _ in range(rnd.randint(num_nodes, 3*num_nodes)):
+        tail, head = rnd.sample(range(num_nodes), 2)
+        if max_weight is None:
+            G.add_edge(tail, head, c=rnd.randint(1, 20), t=round(rnd.random(), 2))
+        else:
+            G.add_edge(tail, head, c=rnd.randint(1, max_weight), t=rnd.randint(1, max_weight))
+    return G
+
+
+def brute_force(G, source, target, upper_bound):
+    """ f of the shortest simple path whose g is at most upper_bound (None if infeasible) """
+    best = None
+    for path in nx.all_simple_edge_paths(G, source, target):
+        f = sum(G.edges[e]['c'] for e in path)
+        g = sum(G.edges[e]['t'] for e in path)
+        if g <= upper_bound + 1e-9 and (best is None or f < best):
+            best = f
+    return best
+
+
+options_list = [
+    dict(),
+    dict(yen=True),
+    dict(warm_start=True),
+    dict(contraction_hierarchy=True),
+    dict(label_setting=True),
+    dict(label_setting=True, max_paths=3),
+    dict(label_setting=True, gap=0.05),
+    dict(parametric=True),
+    dict(parametric=True, time_limit=0),
+    dict(gap=0.05),
+    dict(max_paths=0),
+    dict(max_paths=3),
+    dict(max_paths=3, yen=True),
+    dict(time_limit=0),
+]
+
+
+def query_graphs():
+    """ (G, upper_bounds) of the random graphs with a path from 0 to 7 """
+    graphs = [(random_graph(seed), (0.3, 0.8, 1.5)) for seed in range(30)]
+    graphs += [(random_graph(seed, max_weight=5), (6, 8, 10, 12)) for seed in range(30)]
+    return [(G, upper_bounds) for G, upper_bounds in graphs if nx.has_path(G, 0, 7)]
+
+
+def check_result(G, upper_bound, result, metrics):
+    """ the returned f and g are the ones of the returned path, and f is metrics.UB """
+    path, f, g = result
+    optimum = brute_force(G, 0, 7, upper_bound)
+    if path is None:
+        assert optimum is None and metrics.status == 'infeasible'
+        return
+    assert [tail for tail, _, _ in path[1:]] == [head for _, head, _ in path[:-1]]
+    assert path[0][0] == 0 and path[-1][1] == 7
+    assert f == pytest.approx(sum(G.edges[e]['c'] for e in path))
+    assert g == pytest.approx(sum(G.edges[e]['t'] for e in path))
+    assert g <= upper_bound + 1e-9
+    assert f == pytest.approx(metrics.UB)
+    assert metrics.LB <= metrics.UB + 1e-9
+    if metrics.status == 'optimal':
+        assert f == pytest.approx(optimum)
+    else:
+        assert metrics.LB <= optimum + 1e-9 <= f + 1e-9
+
+
+@pytest.mark.parametrize('kwargs', options_list)
+def test_returned_path(kwargs):
+    options = SolverOptions(verbose=False, **kwargs)
+    for G, upper_bounds in query_graphs():
+        graph = CSRGraph.from_networkx(G)
+        for upper_bound in upper_bounds:
+            metrics = Metrics()
+            result = dual_algorithm(graph, 0, 7, upper_bound, options, metrics=metrics)
+            check_result(G, upper_bound, result, metrics)
+
+
+@pytest.mark.parametrize('kwargs', options_list)
+def test_batch(kwargs):
+    """ the queries of a batch share the trees of the QueryCache (over the edges pruned by STEP0) """
+    options = SolverOptions(verbose=False, **kwargs)
+    for G, upper_bounds in query_graphs():
+        graph = CSRGraph.from_networkx(G)
+        queries = [(0, 7, upper_bound) for upper_bound in upper_bounds]
+        for (_, _, upper_bound), result, metrics in solve_batch(graph, queries, options, QueryCache(graph)):
+            check_result(G, upper_bound, result, metrics)
+
+
+def test_hierarchy_file(tmp_path):
+    """ a single query with --ch reads the hierarchy of graph_file.cch (solved as the ones of a batch) """
+    options = SolverOptions(verbose=False, contraction_hierarchy=True)
+    for i, (G, upper_bounds) in enumerate(query_graphs()):
+        edge_file = str(tmp_path / f'graph{i}.csv')
+        with open(edge_file, 'w') as f:
+            for tail, head, data in G.edges(data=True):
+                f.write(f'{tail},{head},{data["c"]},{data["t"]}\n')
+        graph = CSRGraph.read(edge_file, cache=False)
+        for upper_bound in upper_bounds:
+            metrics = Metrics()
+            hierarchy_builder = functools.partial(ContractionHierarchy.read, graph, edge_file)
+            path, f, g = dual_algorithm(graph, '0', '7', upper_bound, options, metrics=metrics,
+                                        hierarchy_builder=hierarchy_builder)
+            optimum = brute_force(G, 0, 7, upper_bound)
+            if path is None:
+                assert optimum is None and metrics.status == 'infeasible'
+            else:
+                assert f == pytest.approx(optimum) and g <= upper_bound + 1e-9